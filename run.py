@@ -1,2 +1,2 @@
-from waterlp import app
+from waterlp.celery_app import app
 app.start(['celery', 'worker', '-l', 'ERROR'])
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""
+Time the cancellation checks made by a run: starting and stopping a run's cancellation token, and checking it at
+each time step. Runs in the same process share one Redis listener, so only the first token started opens one.
+
+    python scripts/bench_cancellation.py [number of runs] [number of time steps]
+
+This needs the redis package. Without a Redis server, tokens fall back to polling, which is also timed.
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from waterlp.utils.application import CancellationToken
+
+
+def main(nruns=10, nsteps=100000):
+    tokens = []
+    t0 = time.perf_counter()
+    for i in range(nruns):
+        tokens.append(CancellationToken('bench-{}'.format(i)).start())
+    started = time.perf_counter() - t0
+    print('Started {} tokens in {:.3f} s ({} listener)'.format(
+        nruns, started, 'one shared' if CancellationToken._pubsub is not None else 'no'))
+
+    token = tokens[0]
+    t0 = time.perf_counter()
+    for i in range(nsteps):
+        token.is_set()
+    per_step = (time.perf_counter() - t0) / nsteps
+    print('Checked for cancellation {} times: {:.2f} us per step'.format(nsteps, per_step * 1e6))
+
+    t0 = time.perf_counter()
+    token.poll()
+    print('Polled Redis once: {:.2f} ms'.format((time.perf_counter() - t0) * 1e3))
+
+    for token in tokens:
+        token.stop()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,75 @@
+"""
+Time source data ingestion on a synthetic network with layered source scenarios.
+
+    python scripts/bench_ingestion.py [number of resource attributes] [number of dates]
+
+The baseline scenario has a dataset for every resource attribute (one in four a timeseries), and each later layer
+overrides a tenth of them. This times the single pass that builds the source table, and parsing its timeseries in
+each parse mode.
+"""
+
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pendulum
+
+from waterlp.connection import JSONObject
+from waterlp.models.ingestion import PARSE_MODES, ingest_source_data, parse_source_data, timeseries_items
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def resource_scenario(res_attr_id, timeseries, dates, layer):
+    if timeseries:
+        data_type = 'timeseries'
+        value = json.dumps({'0': {d: res_attr_id + i + layer for i, d in enumerate(dates)}})
+    else:
+        data_type = 'scalar'
+        value = str(res_attr_id + layer)
+    return JSONObject({
+        'resource_attr_id': res_attr_id,
+        'attr_id': res_attr_id % 20,
+        'value': JSONObject({'type': data_type, 'value': value, 'metadata': '{}'}),
+    })
+
+
+def make_sources(nattrs, dates, nlayers=3):
+    sources = []
+    for layer in range(nlayers):
+        step = 1 if layer == 0 else 10
+        rss = [resource_scenario(i, i % 4 == 0, dates, layer) for i in range(layer, nattrs, step)]
+        sources.append((layer + 1, JSONObject({'resourcescenarios': rss})))
+    res_index = {i: ('node', i // 20) for i in range(nattrs)}
+    res_tattrs = {i: {'attr_id': i % 20} for i in range(nattrs)}
+    return sources, res_index, res_tattrs
+
+
+def best_time(func, repeat=3):
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+
+def main(nattrs=10000, ndates=365):
+    start = pendulum.datetime(2000, 1, 1)
+    dates = [start.add(days=i).format('YYYY-MM-DD HH:mm:ss') for i in range(ndates)]
+    sources, res_index, res_tattrs = make_sources(nattrs, dates)
+
+    seconds, table = best_time(lambda: ingest_source_data(sources, res_index, res_tattrs, 1))
+    print('Ingested {} resource attributes from {} layers in {:.3f} s'.format(len(table), len(sources), seconds))
+
+    items = timeseries_items(table)
+    for mode in PARSE_MODES:
+        seconds, parsed = best_time(lambda: parse_source_data(items, dates, DATE_FORMAT, mode=mode), repeat=1)
+        print('Parsed {} timeseries ({} mode) in {:.3f} s'.format(len(parsed), mode, seconds))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
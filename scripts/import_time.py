@@ -0,0 +1,54 @@
+"""
+Check how long waterlp's entry points take to import, each in a fresh interpreter, against a time budget.
+
+    python scripts/import_time.py
+
+Importing the package itself should do nothing (no connections, no file system changes), so CLI runs and worker
+processes start quickly. Heavy dependencies (Pywr, PyTables, boto3, PubNub, Ably) are imported where they are used.
+"""
+
+import os
+import sys
+import subprocess
+
+# seconds, for a warm file system cache
+BUDGETS = [
+    ('waterlp', 0.05),
+    ('waterlp.parser', 0.1),
+    ('waterlp.celery_app', 1.0),
+    ('waterlp.bundle', 1.5),
+    ('waterlp.tasks', 2.5),
+]
+
+TIMER = 'import time; t = time.perf_counter(); import {}; print(time.perf_counter() - t)'
+
+
+def import_time(module, repeat=3):
+    """The best of several import times, in seconds, or None if the module can't be imported"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    times = []
+    for i in range(repeat):
+        result = subprocess.run([sys.executable, '-c', TIMER.format(module)], cwd=root, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        if result.returncode:
+            print('{}: failed to import\n{}'.format(module, result.stderr.strip().splitlines()[-1]))
+            return None
+        times.append(float(result.stdout.strip().splitlines()[-1]))
+    return min(times)
+
+
+def main():
+    over = 0
+    for module, budget in BUDGETS:
+        seconds = import_time(module)
+        if seconds is None:
+            over += 1
+            continue
+        status = 'ok' if seconds <= budget else 'OVER BUDGET'
+        print('{}: {:.3f} s (budget {} s) {}'.format(module, seconds, budget, status))
+        over += seconds > budget
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import json
+import threading
+from argparse import Namespace
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandInServer(object):
+    """
+    A local HTTP server standing in for the data server. Each request body is recorded, and answered by
+    respond(body) with a (status, JSON-serializable content) pair. Requests are handled concurrently.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.respond = lambda body: (200, {})
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                server.requests.append((dict(self.headers), body))
+                status, content = server.respond(body)
+                data = json.dumps(content).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('localhost', 0), Handler)
+        self.url = 'http://localhost:{}'.format(self.httpd.server_address[1])
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def server():
+    server = StandInServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def make_connection(tmp_path):
+    """Make a connection to a stand-in server, starting from a minimal network file"""
+    from waterlp.connection import connection
+
+    path = tmp_path / 'network.json'
+    path.write_text(json.dumps({
+        'network': {'id': 1, 'nodes': [], 'links': [], 'types': [], 'attributes': [], 'layout': {}},
+        'template': {'id': 2, 'types': []},
+    }))
+
+    def make(url, **kwargs):
+        args = Namespace(data_url=url, filename=str(path), app_name='test', session_id='s', user_id=1,
+                         network_id=1, template_id=2, max_retries=2, **kwargs)
+        conn = connection(args=args)
+        conn.filename = None  # make calls to the stand-in server from here on
+        return conn
+
+    return make
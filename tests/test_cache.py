@@ -0,0 +1,66 @@
+import json
+
+from waterlp.utils.cache import ResponseCache, revision_token
+
+NETWORK = {
+    'id': 1,
+    'cr_date': '2020-01-01',
+    'updated_at': '2020-02-01',
+    'scenarios': [{'id': 3, 'cr_date': '2020-01-01', 'updated_at': '2020-02-01'}, {'id': 4, 'cr_date': '2020-01-01'}],
+}
+TEMPLATE = {'id': 2, 'updated_at': '2020-02-01'}
+
+
+def test_revision_token_changes_with_edits():
+    token = revision_token(NETWORK, [3], TEMPLATE)
+    edited = dict(NETWORK, scenarios=[dict(NETWORK['scenarios'][0], updated_at='2020-03-01')])
+    assert token and revision_token(edited, [3], TEMPLATE) != token
+    assert revision_token(NETWORK, [3], dict(TEMPLATE, updated_at='2020-03-01')) != token
+
+
+def test_no_token_without_modification_dates():
+    assert revision_token(dict(NETWORK, updated_at=None), [3], TEMPLATE) is None
+    assert revision_token(NETWORK, [4], TEMPLATE) is None  # only a creation date
+    assert revision_token(NETWORK, [3], dict(TEMPLATE, updated_at=None)) is None
+    assert revision_token(NETWORK, [3]) is None
+
+
+def test_cache_round_trip(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path), max_entries=2)
+    cache.put(['a'], 'token', {'x': 1})
+    assert cache.get(['a'], 'token') == {'x': 1}
+    assert cache.get(['a'], 'other token') is None
+    cache.put(['b'], 'token', 2)
+    cache.put(['c'], 'token', 3)
+    assert len(list(tmp_path.glob('*.json.gz'))) == 2
+
+
+def test_template_edits_invalidate_a_cached_network(server, tmp_path, monkeypatch):
+    from argparse import Namespace
+    from functools import partial
+
+    from waterlp import connection as connection_module
+
+    monkeypatch.setattr(connection_module, 'ResponseCache', partial(ResponseCache, directory=str(tmp_path)))
+    network = {'id': 1, 'updated_at': '2020-02-01', 'nodes': [], 'links': [], 'types': [], 'attributes': [],
+               'layout': {}, 'scenarios': []}
+    template = dict(TEMPLATE, types=[])
+    calls = []
+
+    def respond(body):
+        (func, args), = json.loads(body).items()
+        calls.append((func, args.get('include_data')))
+        return 200, template if func == 'get_template' else network
+
+    server.respond = respond
+    args = Namespace(data_url=server.url, filename=None, app_name='test', session_id='s', user_id=1, network_id=1,
+                     template_id=2, max_retries=0, use_cache=True)
+
+    connection_module.connection(args=args)
+    connection_module.connection(args=args)
+    assert calls.count(('get_network', 'Y')) == 1  # the second connection used the cache
+
+    template['updated_at'] = '2020-03-01'
+    conn = connection_module.connection(args=args)
+    assert calls.count(('get_network', 'Y')) == 2
+    assert conn.template['updated_at'] == '2020-03-01'
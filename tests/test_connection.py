@@ -0,0 +1,122 @@
+import json
+import socket
+
+import pytest
+from requests.exceptions import ConnectionError
+
+from waterlp import connection as connection_module
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(connection_module, 'RETRY_BACKOFF', 0)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def test_reads_are_retried_when_the_server_is_unavailable(server, make_connection):
+    conn = make_connection(server.url)
+    statuses = [503, 503, 200]
+    server.respond = lambda body: (statuses.pop(0), {'id': 5})
+    assert conn.call('get_scenario', {'scenario_id': 5}) == {'id': 5}
+    assert len(server.requests) == 3
+
+
+def test_writes_are_not_retried_once_sent(server, make_connection):
+    conn = make_connection(server.url)
+    server.respond = lambda body: (503, {'faultcode': 'unavailable', 'faultstring': ''})
+    conn.call('add_scenario', {'network_id': 1, 'scen': {}})
+    assert len(server.requests) == 1
+
+
+def test_writes_are_retried_if_never_sent(make_connection):
+    conn = make_connection('http://localhost:{}'.format(free_port()))  # nothing is listening
+    attempts = []
+    post = conn.session.post
+
+    def counted_post(*args, **kwargs):
+        attempts.append(1)
+        return post(*args, **kwargs)
+
+    conn.session.post = counted_post
+    with pytest.raises(ConnectionError):
+        conn.call('add_scenario', {'network_id': 1, 'scen': {}})
+    assert len(attempts) == conn.max_retries + 1
+
+
+def test_calls_are_not_batched_unless_asked_for(server, make_connection):
+    conn = make_connection(server.url)
+    server.respond = lambda body: (200, {'id': 1})
+    assert conn.call_batch([('get_scenario', {'scenario_id': 1}), ('get_scenario', {'scenario_id': 2})]) == [
+        {'id': 1}, {'id': 1}]
+    assert all(type(json.loads(body)) == dict for headers, body in server.requests)
+
+
+def test_batches(server, make_connection):
+    conn = make_connection(server.url, batch_calls=True)
+    server.respond = lambda body: (200, [{'id': call['get_scenario']['scenario_id']} for call in json.loads(body)])
+    assert conn.call_batch([('get_scenario', {'scenario_id': 1}), ('get_scenario', {'scenario_id': 2})]) == [
+        {'id': 1}, {'id': 2}]
+    assert len(server.requests) == 1 and conn.accepts_batch
+
+
+def test_batches_are_kept_after_a_passing_failure(server, make_connection):
+    conn = make_connection(server.url, batch_calls=True)
+    conn.max_retries = 0
+    responses = [(500, {'faultcode': 'error', 'faultstring': ''}), (200, {'id': 1}), (200, {'id': 2})]
+    server.respond = lambda body: responses.pop(0)
+    calls = [('get_scenario', {'scenario_id': 1}), ('get_scenario', {'scenario_id': 2})]
+    assert conn.call_batch(calls) == [{'id': 1}, {'id': 2}]
+    assert conn.accepts_batch is None
+
+    server.respond = lambda body: (400, {'faultcode': 'bad request', 'faultstring': ''}) \
+        if type(json.loads(body)) == list else (200, {'id': 3})
+    assert conn.call_batch(calls) == [{'id': 3}, {'id': 3}]
+    assert conn.accepts_batch is False
+
+
+def test_scenarios_failing_in_a_batch_are_fetched_again(server, make_connection):
+    conn = make_connection(server.url, batch_calls=True)
+
+    def respond(body):
+        calls = json.loads(body)
+        if type(calls) == list:
+            return 200, [{'faultcode': 'error', 'faultstring': 'timed out'} if call['get_scenario']['scenario_id'] == 2
+                         else {'id': call['get_scenario']['scenario_id']} for call in calls]
+        return 200, {'id': calls['get_scenario']['scenario_id']}
+
+    server.respond = respond
+    assert conn.get_scenarios([1, 2]) == [{'id': 1}, {'id': 2}]
+
+
+def test_missing_scenarios_are_reported(server, make_connection):
+    conn = make_connection(server.url)
+    server.respond = lambda body: (200, {'faultcode': 'not found', 'faultstring': 'Scenario 4 not found'})
+    with pytest.raises(Exception, match='Could not get scenario 4'):
+        conn.get_scenario(4)
+    assert conn.get_scenarios([4], required=False) == [None]
+
+
+def test_gzip_is_dropped_if_the_server_cannot_read_it(server, make_connection):
+    conn = make_connection(server.url)
+    server.respond = lambda body: (400, {'faultcode': 'bad request', 'faultstring': ''}) \
+        if body[:2] == b'\x1f\x8b' else (200, {'id': 1})
+    assert conn.call('update_scenario', {'scen': {}}, compress=True) == {'id': 1}
+    assert len(server.requests) == 2 and conn.accepts_gzip is False
+    assert conn.call('update_scenario', {'scen': {}}, compress=True) == {'id': 1}
+    assert len(server.requests) == 3
+
+
+def test_gzip_is_only_accepted_after_a_success(server, make_connection):
+    conn = make_connection(server.url)
+    server.respond = lambda body: (500, {'faultcode': 'error', 'faultstring': ''})
+    conn.call('update_scenario', {'scen': {}}, compress=True)
+    assert len(server.requests) == 1 and conn.accepts_gzip is None
+
+    server.respond = lambda body: (200, {'id': 1})
+    conn.call('update_scenario', {'scen': {}}, compress=True)
+    assert conn.accepts_gzip is True
@@ -0,0 +1,40 @@
+import json
+from datetime import date, timedelta
+
+from waterlp.models.evaluator import make_periodic_labels, eval_periodic_timeseries, expand_periodic
+
+
+def days(start, end):
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def periodic_timeseries():
+    """A periodic timeseries whose value on each day is its month * 100 + day"""
+    return json.dumps({'0': {'{} 00:00:00'.format(d): d.month * 100 + d.day
+                             for d in days(date(9999, 1, 1), date(9999, 12, 31))}})
+
+
+def test_daily_periodic_values_in_leap_years():
+    dates = days(date(2019, 1, 1), date(2020, 12, 31))
+    dates_as_string = ['{} 00:00:00'.format(d) for d in dates]
+    periodic_timesteps = [(d - date(d.year, 1, 1)).days + 1 for d in dates]  # as make_dates numbers days
+
+    labels, index = make_periodic_labels(dates_as_string, periodic_timesteps, daily=True)
+    values = expand_periodic(eval_periodic_timeseries(periodic_timeseries(), labels), index)
+
+    by_date = dict(zip(dates_as_string, values))
+    assert len(labels) == 365
+    assert by_date['2019-03-01 00:00:00'] == 301
+    assert by_date['2020-02-28 00:00:00'] == 228
+    assert by_date['2020-02-29 00:00:00'] == 228
+    assert by_date['2020-03-01 00:00:00'] == 301
+    assert by_date['2020-12-31 00:00:00'] == 1231
+
+
+def test_monthly_periodic_values():
+    dates_as_string = ['{}-{:02}-01 00:00:00'.format(y, m) for y in (2019, 2020) for m in range(1, 13)]
+    periodic_timesteps = [i % 12 + 1 for i in range(24)]
+
+    labels, index = make_periodic_labels(dates_as_string, periodic_timesteps)
+    values = expand_periodic(eval_periodic_timeseries(periodic_timeseries(), labels), index)
+    assert list(values[:12]) == list(values[12:]) == [m * 100 + 1 for m in range(1, 13)]
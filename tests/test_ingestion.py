@@ -0,0 +1,65 @@
+import json
+
+import numpy
+
+from waterlp.connection import JSONObject
+from waterlp.models.ingestion import SourceTable, parse_source_data, timeseries_items
+
+DATES = ['2000-01-01 00:00:00', '2000-01-02 00:00:00', '2000-01-03 00:00:00']
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def resource_scenario(res_attr_id, value, data_type='timeseries', metadata=None):
+    return JSONObject({
+        'resource_attr_id': res_attr_id,
+        'attr_id': res_attr_id,
+        'value': JSONObject({'type': data_type, 'value': value, 'metadata': json.dumps(metadata or {})}),
+    })
+
+
+def make_table():
+    table = SourceTable()
+    blocks = {'0': {DATES[0]: 1.5, DATES[1]: 2.0}, '1': {DATES[0]: 1.0, DATES[1]: 1.0}}
+    table.add(1, ('node', 1, 1), 1, resource_scenario(1, json.dumps({'0': {DATES[0]: 1.5, DATES[1]: 2.0}})))
+    table.add(2, ('node', 2, 2), 1, resource_scenario(2, json.dumps(blocks)))
+    table.add(3, ('node', 3, 3), 1, resource_scenario(3, 'return 1', metadata={'use_function': 'Y'}))
+    table.add(4, ('node', 4, 4), 1, resource_scenario(4, '5', data_type='scalar'))
+    return table
+
+
+def test_timeseries_items():
+    items = timeseries_items(make_table())
+    assert [row for row, ts in items] == [0, 1]
+    assert timeseries_items(make_table(), exclude={0: None}) == items[1:]
+
+
+def test_serial_and_pooled_parsing_agree():
+    items = timeseries_items(make_table())
+    serial = parse_source_data(items, DATES, DATE_FORMAT, mode='serial')
+
+    numpy.testing.assert_array_equal(serial[0], [1.5, 2.0, numpy.nan])
+    numpy.testing.assert_array_equal(serial[1], [2.5, 3.0, numpy.nan])  # blocks are summed
+
+    for mode in ['thread', 'process']:
+        pooled = parse_source_data(items, DATES, DATE_FORMAT, mode=mode, workers=2, chunksize=1)
+        assert sorted(pooled) == sorted(serial)
+        for row in serial:
+            numpy.testing.assert_array_equal(pooled[row], serial[row])
+
+
+def test_later_layers_override_unless_empty():
+    table = make_table()
+    table.add(4, ('node', 4, 4), 2, resource_scenario(4, '7', data_type='scalar'))
+    table.add(1, ('node', 1, 1), 2, resource_scenario(1, ''))
+    table.add(2, ('node', 2, 2), 2, resource_scenario(2, None))
+    assert len(table) == 4
+    assert table.source_ids == [1, 1, 1, 2]
+    assert table.resource_scenarios[3].value.value == '7'
+
+
+def test_outputs_are_not_parsed():
+    tattr = lambda is_var, intermediary=False: {'is_var': is_var, 'properties': {'intermediary': intermediary}}
+    tattrs = {('node', 1, 1): tattr('N'), ('node', 2, 2): tattr('Y')}
+    assert [row for row, ts in timeseries_items(make_table(), tattrs=tattrs)] == [0]
+    tattrs[('node', 2, 2)] = tattr('Y', intermediary=True)
+    assert [row for row, ts in timeseries_items(make_table(), tattrs=tattrs)] == [0, 1]
@@ -0,0 +1,38 @@
+import numpy
+
+from waterlp.utils.local_results import write_results, LocalResults
+
+DATES = ['2000-01-01 00:00:00', '2000-01-02 00:00:00', '2000-01-03 00:00:00', '2000-01-04 00:00:00']
+
+
+def write(path):
+    groups = {
+        ('node', 7): {
+            'attr_name': 'Storage',
+            'unit': 'hm^3',
+            'rows': [(1, 'Reservoir A', numpy.arange(4.0)), (2, 'Reservoir B', lambda: numpy.arange(4.0) * 10)],
+        }
+    }
+    write_results(str(path), DATES, groups, metadata={'run': 'test'})
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'results.h5'
+    write(path)
+    with LocalResults(str(path)) as results:
+        assert results.metadata == {'run': 'test'}
+        assert results.attributes() == [('node', 'Storage')]
+        df = results.read('node', 'Storage')
+        assert list(df.columns) == ['Reservoir A', 'Reservoir B']
+        numpy.testing.assert_array_equal(df['Reservoir B'].values, [0, 10, 20, 30])
+        assert list(results.read('node', 7, resources=[1]).columns) == ['Reservoir A']
+
+
+def test_date_range_is_inclusive(tmp_path):
+    path = tmp_path / 'results.h5'
+    write(path)
+    with LocalResults(str(path)) as results:
+        df = results.read('node', 'Storage', start='2000-01-02', end='2000-01-03')
+        assert list(df.index) == DATES[1:3]
+        df = results.read('node', 'Storage', start=DATES[1], end=DATES[2])
+        assert list(df.index) == DATES[1:3]
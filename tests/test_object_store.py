@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+from waterlp.utils.object_store import LocalBackend, upload_file
+
+
+def test_multipart_round_trip(tmp_path):
+    path = tmp_path / 'results.h5'
+    data = os.urandom(10 * 1000 + 7)
+    path.write_bytes(data)
+    backend = LocalBackend(str(tmp_path / 'bucket'))
+
+    assert upload_file(backend, 'results/P1/N2/results.h5', str(path), part_size=1000, max_workers=3) == 11
+    stored = tmp_path / 'bucket' / 'results' / 'P1' / 'N2' / 'results.h5'
+    assert stored.read_bytes() == data
+    assert os.listdir(str(stored.parent)) == ['results.h5']  # the parts are removed
+
+
+def test_small_files_are_uploaded_whole(tmp_path):
+    path = tmp_path / 'results.h5'
+    path.write_bytes(b'results')
+    backend = LocalBackend(str(tmp_path / 'bucket'))
+    assert upload_file(backend, 'results.h5', str(path), part_size=1000) == 1
+    assert (tmp_path / 'bucket' / 'results.h5').read_bytes() == b'results'
+
+
+def test_failed_uploads_are_aborted(tmp_path):
+    path = tmp_path / 'results.h5'
+    path.write_bytes(os.urandom(5000))
+
+    class FailingBackend(LocalBackend):
+        def upload_part(self, key, upload_id, part_number, body):
+            if part_number == 3:
+                raise IOError('part failed')
+            return super(FailingBackend, self).upload_part(key, upload_id, part_number, body)
+
+    backend = FailingBackend(str(tmp_path / 'bucket'))
+    with pytest.raises(IOError):
+        upload_file(backend, 'results.h5', str(path), part_size=1000)
+    assert os.listdir(str(tmp_path / 'bucket')) == []
@@ -0,0 +1,81 @@
+import asyncio
+import json
+import threading
+import time
+from argparse import Namespace
+
+import pytest
+
+websockets = pytest.importorskip('websockets')
+
+from waterlp.reporter_websocket import Reporter
+
+
+class WebsocketServer(object):
+    """A local websocket server that records the actions it receives, and drops the first connection after one"""
+
+    def __init__(self):
+        self.actions = []
+        self.connections = 0
+        self.loop = asyncio.new_event_loop()
+        started = threading.Event()
+
+        async def serve():
+            return await websockets.serve(self.handler, 'localhost', 0)
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(serve())
+            self.url = 'ws://localhost:{}'.format(self.server.sockets[0].getsockname()[1])
+            started.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        started.wait(timeout=10)
+
+    async def handler(self, websocket, *args):
+        self.connections += 1
+        connection = self.connections
+        async for message in websocket:
+            action = json.loads(message)['action']
+            if action == 'ping':
+                continue
+            self.actions.append(action)
+            if connection == 1:
+                return  # drop the connection
+
+    def close(self):
+        async def stop():
+            self.server.close()
+            await self.server.wait_closed()
+
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result(timeout=5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=5)
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_reconnects_without_losing_events():
+    server = WebsocketServer()
+    try:
+        args = Namespace(websocket_url=server.url, unique_id='run-1', source_id=1, network_id=2)
+        reporter = Reporter(args)
+        assert wait_for(lambda: server.connections == 2)  # reconnected after the first connection was dropped
+
+        reporter.step(1, 2)
+        reporter.step(2, 2)
+        reporter.done(2, 2)
+        assert not reporter._thread.is_alive()
+        assert wait_for(lambda: len(server.actions) == 4)
+        assert server.actions == ['start', 'step', 'step', 'done']
+    finally:
+        server.close()
@@ -0,0 +1,29 @@
+from types import SimpleNamespace
+
+from waterlp.models.results import ResultTable, FLOW
+
+DATES = ['2000-01-0{} 00:00:00'.format(d) for d in range(1, 8)]
+
+
+def test_stored_values_spill_with_results(tmp_path):
+    node = SimpleNamespace(flow=[0.0])
+    store = {'node/1/2': {}}
+
+    results = ResultTable(len(DATES), flush_every=2, spill_dir=str(tmp_path))
+    results.bind('node/1/3', node, FLOW, 1.0)
+    results.bind_stored('node/1/2')
+    results.bind_store(store, DATES)
+    results.allocate()
+    assert results.output_keys == ['node/1/3']
+
+    for tsidx, date in enumerate(DATES):
+        store['node/1/2'][date] = tsidx * 10.0
+        node.flow[0] = tsidx
+        results.collect(tsidx)
+        assert len(store['node/1/2']) <= 2  # flushed dates are dropped from the store
+    results.flush()
+
+    assert store['node/1/2'] == {}
+    assert results.row_values(results.rows['node/1/2']).tolist() == [d * 10.0 for d in range(7)]
+    assert results.row_values(results.rows['node/1/3']).tolist() == list(range(7))
+    results.close()
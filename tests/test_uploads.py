@@ -0,0 +1,54 @@
+import gzip
+import json
+import threading
+import time
+
+from waterlp.utils.uploads import ResultUploader
+
+
+def test_chunks_are_uploaded_concurrently(server, make_connection):
+    conn = make_connection(server.url)
+    lock = threading.Lock()
+    in_flight = [0]
+    max_in_flight = [0]
+
+    def respond(body):
+        with lock:
+            in_flight[0] += 1
+            max_in_flight[0] = max(max_in_flight[0], in_flight[0])
+        time.sleep(0.1)
+        with lock:
+            in_flight[0] -= 1
+        return 200, {'id': 9}
+
+    server.respond = respond
+    progress = []
+    uploader = ResultUploader(conn, {'id': 9, 'name': 'results'}, max_workers=4, max_items=10,
+                              on_progress=progress.append)
+    for i in range(100):
+        uploader.add({'resource_attr_id': i, 'value': {'value': '{}'}}, 0.001)
+    uploader.close()
+
+    assert uploader.nchunks == 10
+    assert max_in_flight[0] > 1
+    assert progress[-1] == 100
+
+    sent = []
+    for headers, body in server.requests:
+        if headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        sent.extend(rs['resource_attr_id'] for rs in json.loads(body)['update_scenario']['scen']['resourcescenarios'])
+    assert sorted(sent) == list(range(100))
+
+
+def test_abort_shuts_down_the_executor(server, make_connection):
+    conn = make_connection(server.url)
+    server.respond = lambda body: (200, {'faultcode': 'error', 'faultstring': 'failed'})
+    uploader = ResultUploader(conn, {'id': 9}, max_workers=1, max_items=1)
+    try:
+        for i in range(5):
+            uploader.add({'resource_attr_id': i}, 0.001)
+    except Exception:
+        uploader.abort()
+    assert uploader.executor._shutdown
+    assert not uploader.pending
@@ -0,0 +1,16 @@
+import numpy
+
+from waterlp.models.variations import variation_mask, apply_variation
+
+DATES = ['2000-01-01 00:00:00', '2000-01-02 00:00:00', '2000-01-03 00:00:00', '2000-01-04 00:00:00']
+
+
+def test_window_given_as_dates_includes_its_last_day():
+    variation = {'operator': 'multiply', 'value': 2, 'start': '2000-01-02', 'end': '2000-01-03'}
+    assert variation_mask(variation, DATES) == slice(1, 3)
+    numpy.testing.assert_array_equal(apply_variation(numpy.ones(4), variation, DATES), [1, 2, 2, 1])
+
+
+def test_window_given_as_datetimes():
+    variation = {'operator': 'add', 'value': 1, 'start': DATES[1], 'end': DATES[2]}
+    assert variation_mask(variation, DATES) == slice(1, 3)
@@ -0,0 +1,195 @@
+"""
+Compile a network, its template and selected scenarios into a bundle for fast offline runs (with --f).
+
+A bundle is a directory with the network topology, template and non-timeseries data as JSON, and every plain
+timeseries pre-parsed into numeric arrays, saved so they can be memory-mapped:
+
+    bundle.json     network (including scenarios) and template; bundled timeseries values are replaced by an index
+    calendar.npy    all distinct timeseries dates, sorted
+    dates.npy       for each timeseries value, the index of its date in the calendar
+    values.npy      all timeseries values, concatenated
+    offsets.npy     where each timeseries starts (and the last ends) in dates.npy and values.npy
+
+Usage:
+
+    python -m waterlp.main bundle --durl ... --uid 1 --sid ... --nid 1 --tid 2 --scids "[(3, 4)]" --out ./network
+"""
+
+import os
+import sys
+import json
+from io import StringIO
+from ast import literal_eval
+
+import numpy
+import pandas
+
+from waterlp.connection import connection, JSONObject
+
+BUNDLE_VERSION = 1
+BUNDLE_FILE = 'bundle.json'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+_bundles = {}  # loaded bundles, by path
+
+
+def parse_timeseries(timeseries, date_format=DATE_FORMAT):
+    """Parse a timeseries, with blocks summed and missing values as 0, into dates (as strings) and values"""
+    df = pandas.read_json(StringIO(timeseries) if type(timeseries) == str else timeseries)
+    if df.empty:
+        return [], numpy.zeros(0)
+    df.fillna(value=0, inplace=True)
+    series = df.sum(axis=1)
+    return list(series.index.strftime(date_format=date_format)), series.values.astype(float)
+
+
+def create_bundle(network, template, path, date_format=DATE_FORMAT):
+    """
+    Write a bundle of the network (with its scenarios, which should include the ancestors of the scenarios to be
+    run) and template.
+    """
+
+    series = []
+    for scenario in network.get('scenarios', []):
+        for rs in scenario.get('resourcescenarios', []):
+            value = rs['value']
+            metadata = json.loads(value.get('metadata') or '{}')
+            if value['type'] != 'timeseries' or metadata.get('use_function', 'N') == 'Y':
+                continue
+            dates, values = parse_timeseries(value['value'], date_format=date_format)
+            del value['value']
+            value['bundled'] = len(series)
+            series.append((dates, values))
+
+    calendar = sorted(set(date for dates, values in series for date in dates))
+    calendar_index = {date: i for i, date in enumerate(calendar)}
+    offsets = numpy.zeros(len(series) + 1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum([len(values) for dates, values in series])
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    numpy.save(os.path.join(path, 'calendar.npy'), numpy.array(calendar, dtype=bytes))
+    numpy.save(os.path.join(path, 'offsets.npy'), offsets)
+    numpy.save(os.path.join(path, 'dates.npy'), numpy.array(
+        [calendar_index[date] for dates, values in series for date in dates], dtype=numpy.int32))
+    numpy.save(os.path.join(path, 'values.npy'), numpy.concatenate(
+        [values for dates, values in series]) if series else numpy.zeros(0))
+
+    with open(os.path.join(path, BUNDLE_FILE), 'w') as f:
+        json.dump({'version': BUNDLE_VERSION, 'date_format': date_format, 'network': network, 'template': template},
+                  f)
+
+    return len(series)
+
+
+class BundledValue(JSONObject):
+    """
+    A dataset value whose timeseries is held in a bundle's arrays.
+    Its JSON is only rebuilt if something asks for it (e.g., a function evaluating it over a date range).
+    """
+
+    def __missing__(self, key):
+        if key != 'value' or '_bundle' not in self:
+            raise KeyError(key)
+        dates, values = load_bundle(self['_bundle']).get(self['bundled'])
+        self['value'] = json.dumps({'0': dict(zip(dates, values.tolist()))})
+        return self['value']
+
+
+class Bundle(object):
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+
+        def object_hook(obj):
+            if 'bundled' in obj:
+                obj['_bundle'] = self.path
+                return BundledValue(obj)
+            return JSONObject(obj)
+
+        with open(os.path.join(path, BUNDLE_FILE)) as f:
+            data = json.load(f, object_hook=object_hook)
+        if data.get('version') != BUNDLE_VERSION:
+            raise Exception('Unsupported bundle version: {}'.format(data.get('version')))
+
+        self.date_format = data['date_format']
+        self.network = data['network']
+        self.template = data['template']
+        self.calendar = numpy.load(os.path.join(path, 'calendar.npy'))
+        self.offsets = numpy.load(os.path.join(path, 'offsets.npy'))
+        self.dates = numpy.load(os.path.join(path, 'dates.npy'), mmap_mode='r')
+        self.values = numpy.load(os.path.join(path, 'values.npy'), mmap_mode='r')
+        self._run_index = {}
+
+    def __reduce__(self):
+        # pickle just the path, so the arrays aren't copied into each pickled system
+        return load_bundle, (self.path,)
+
+    def get(self, i):
+        """A bundled timeseries, as dates (as strings) and values"""
+        i0, i1 = self.offsets[i], self.offsets[i + 1]
+        dates = [d.decode() for d in self.calendar[self.dates[i0:i1]]]
+        return dates, numpy.array(self.values[i0:i1])
+
+    def run_index(self, dates_as_string):
+        """The calendar index of each run date (-1 if not in the calendar)"""
+        key = (dates_as_string[0], dates_as_string[-1], len(dates_as_string)) if dates_as_string else None
+        if key not in self._run_index:
+            run_dates = numpy.array(dates_as_string, dtype=bytes)
+            if not len(self.calendar):
+                self._run_index[key] = numpy.full(len(run_dates), -1)
+            else:
+                idx = numpy.searchsorted(self.calendar, run_dates)
+                idx[idx >= len(self.calendar)] = 0
+                self._run_index[key] = numpy.where(self.calendar[idx] == run_dates, idx, -1)
+        return self._run_index[key]
+
+    def align(self, i, dates_as_string):
+        """A bundled timeseries as an array aligned to dates_as_string (NaN where it has no value)"""
+        i0, i1 = self.offsets[i], self.offsets[i + 1]
+        if i0 == i1:
+            return numpy.zeros(len(dates_as_string))  # as with an empty timeseries
+        full = numpy.full(len(self.calendar) + 1, numpy.nan)  # the extra, last value is for dates not found
+        full[self.dates[i0:i1]] = self.values[i0:i1]
+        return full[self.run_index(dates_as_string)]
+
+    def parse_rows(self, resource_scenarios, dates_as_string):
+        """Aligned arrays for the bundled timeseries among resource scenarios, by position"""
+        return {row: self.align(rs.value['bundled'], dates_as_string) for row, rs in enumerate(resource_scenarios)
+                if 'bundled' in rs.value}
+
+
+def load_bundle(path):
+    """Load a bundle, once per process"""
+    path = os.path.abspath(path)
+    if path not in _bundles:
+        _bundles[path] = Bundle(path)
+    return _bundles[path]
+
+
+def main(argv):
+    from waterlp.parser import commandline_parser
+
+    parser = commandline_parser()
+    parser.add_argument('--out', dest='bundle_path', required=True, help='''The directory to write the bundle to.''')
+    args, unknown = parser.parse_known_args(argv)
+    if args.filename:
+        raise Exception('A bundle is made from data on the data server, not a file.')
+
+    scenario_ids = literal_eval(args.scenario_ids) if args.scenario_ids else []
+    all_scenario_ids = list(set(sum([tuple(s) if type(s) in (list, tuple) else (s,) for s in scenario_ids], ())))
+
+    conn = connection(args=args, scenario_ids=all_scenario_ids)
+
+    # include the scenarios' ancestors, since there is no data server to get them from in an offline run
+    basic_network = conn.get_basic_network()
+    conn.prefetch_ancestors(all_scenario_ids, basic_network.scenarios)
+    network = conn.network
+    network['scenarios'] = [s for s in conn.scenarios.values() if s is not None]
+
+    count = create_bundle(network, conn.template, args.bundle_path)
+    print('Bundled {} scenarios and {} timeseries in {}'.format(len(network['scenarios']), count, args.bundle_path))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
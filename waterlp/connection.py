@@ -1,6 +1,41 @@
+import os
+import gzip
 import json
+import time
 
-from requests import post
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, ConnectTimeout, Timeout
+from urllib3.exceptions import NewConnectionError
+
+from waterlp.utils.cache import ResponseCache, revision_token
+
+try:
+    import ijson  # optional: decode large responses incrementally, as they are downloaded
+except ImportError:
+    ijson = None
+
+# the maximum number of pooled connections to the data server, e.g., for concurrent result uploads
+POOL_SIZE = 8
+
+TIMEOUT = (10, 500)  # (connect, read) timeouts, in seconds
+RETRY_STATUSES = [502, 503, 504]  # server responses that are worth retrying (for reads only)
+READ_PREFIXES = ('get_',)  # calls that only read, so are safe to repeat
+BATCH_UNSUPPORTED = [400, 404, 405, 415]  # server responses to a batch meaning batches aren't supported
+GZIP_UNSUPPORTED = [400, 415]  # server responses to a gzipped request that may mean it can't read gzip
+RETRY_BACKOFF = 0.5  # seconds, doubled after each retry
+
+
+def is_read(func):
+    return func.startswith(READ_PREFIXES)
+
+
+def not_sent(err):
+    """Whether a failed request certainly never reached the server (i.e., the connection couldn't be made)"""
+    if isinstance(err, ConnectTimeout):
+        return True
+    reason = getattr(err.args[0], 'reason', None) if err.args else None
+    return isinstance(reason, NewConnectionError)
 
 
 class connection(object):
@@ -13,6 +48,17 @@ class connection(object):
         self.user_id = int(args.user_id)
         self.log = log
 
+        # a pooled session, so connections are kept alive and reused between calls
+        self.session = Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.accepts_gzip = None  # whether the server accepts gzipped requests (None = unknown)
+        # whether the server accepts batched calls (None = unknown); batches are only tried if asked for
+        self.accepts_batch = None if getattr(args, 'batch_calls', False) else False
+        self.max_retries = getattr(args, 'max_retries', 3)
+        self.metrics = {}  # call type -> call count, errors, total and maximum seconds
+
         self.network_id = int(args.network_id)
         self.template_id = int(args.template_id) if args.template_id else None
 
@@ -25,7 +71,16 @@ class connection(object):
         if self.template_id:
             get_network_params.update({'template_id': self.template_id})
 
-        if args.filename:
+        self.bundle = None
+        if args.filename and os.path.isdir(args.filename):
+            # a precompiled bundle (see waterlp.bundle)
+            from waterlp.bundle import load_bundle
+            self.bundle = load_bundle(args.filename)
+            self.network = self.bundle.network
+            self.template = self.bundle.template
+            self.template_id = self.template.get('id')
+
+        elif args.filename:
             with open(args.filename) as f:
                 data = json.load(f, object_hook=JSONObject)
                 self.network = data.get('network')
@@ -34,15 +89,60 @@ class connection(object):
                 self.template_id = self.template.get('id')
 
         else:
-            response = self.call('get_network', get_network_params)
-            if 'faultcode' in response:
-                if 'session' in response.get('faultcode', '').lower():
-                    self.login(username=args.hydra_username, password=args.hydra_password)
-                response = self.call('get_network', get_network_params)
+            # check for a cached copy of this revision of the network (and its template) first
+            cache = token = template = None
+            cache_key = [self.network_id, sorted(scenario_ids or []), self.template_id]
+            if getattr(args, 'use_cache', False):
+                cache = ResponseCache(object_hook=JSONObject)
+                basic_network_params = dict(network_id=self.network_id, include_data='N', summary='N',
+                                            include_resources='N')
+                response = self.call('get_network', basic_network_params)
+                if 'faultcode' in response:
+                    if 'session' in response.get('faultcode', '').lower():
+                        self.login(username=args.hydra_username, password=args.hydra_password)
+                    response = self.call('get_network', basic_network_params)
+                if 'faultcode' not in response:
+                    # the template is small, so it's always fetched, both for its revision and to use as is
+                    template_id = self.template_id or (response.get('layout') or {}).get('active_template_id')
+                    template = template_id and self.call('get_template', {'template_id': template_id})
+                    if template and 'faultcode' not in template:
+                        token = revision_token(response, scenario_ids, template)
+            cached = token and cache.get(cache_key, token)
 
-            self.network = response
-            self.template_id = self.template_id or self.network.layout.get('active_template_id')
-            self.template = self.template_id and self.call('get_template', {'template_id': self.template_id})
+            if cached:
+                self.network = cached['network']
+                self.template = template
+                self.template_id = self.template_id or self.network.layout.get('active_template_id')
+
+            else:
+                # if the template is known, get it along with the network
+                calls = [('get_network', get_network_params)]
+                if self.template_id and not token:
+                    calls.append(('get_template', {'template_id': self.template_id}))
+
+                responses = self.call_batch(calls, stream=True)
+                response = responses[0]
+                if 'faultcode' in response:
+                    if 'session' in response.get('faultcode', '').lower():
+                        self.login(username=args.hydra_username, password=args.hydra_password)
+                    responses = self.call_batch(calls, stream=True)
+                    response = responses[0]
+
+                self.network = response
+                if token:
+                    self.template = template  # already fetched for the revision token
+                    self.template_id = self.template_id or self.network.layout.get('active_template_id')
+                elif len(responses) > 1:
+                    self.template = responses[1]
+                else:
+                    self.template_id = self.template_id or self.network.layout.get('active_template_id')
+                    self.template = self.template_id and self.call('get_template', {'template_id': self.template_id})
+
+                if token and 'faultcode' not in self.network and self.template and 'faultcode' not in self.template:
+                    cache.put(cache_key, token, {'network': self.network})
+
+        # scenarios with data, by ID, shared by all scenarios in this run
+        self.scenarios = {s.id: s for s in self.network.get('scenarios', [])}
 
         # create some useful dictionaries
         # Since pyomo doesn't know about attribute ids, etc., we need to be able to relate
@@ -90,14 +190,88 @@ class connection(object):
         for link in self.network.links:
             process_resource('link', link)
 
-    def call(self, func, args):
+    def post(self, data, headers, cookie, stream=False, idempotent=False):
+        """
+        Post to the data server, retrying with backoff if the connection fails or the server is unavailable.
+
+        Calls that write (i.e., are not idempotent) are only retried if the request never reached the server, since
+        repeating one that did might, for example, add a scenario twice.
+        """
+
+        retries = 0
+        while True:
+            try:
+                response = self.session.post(self.url, data=data, headers=headers, cookies=cookie, timeout=TIMEOUT,
+                                             stream=stream)
+                if not idempotent or response.status_code not in RETRY_STATUSES or retries >= self.max_retries:
+                    return response
+            except (ConnectionError, Timeout) as err:
+                if retries >= self.max_retries or not idempotent and not not_sent(err):
+                    raise
+            time.sleep(RETRY_BACKOFF * 2 ** retries)
+            retries += 1
+
+    def record(self, func, seconds, ok=True):
+        metrics = self.metrics.get(func)
+        if metrics is None:
+            metrics = self.metrics[func] = {'calls': 0, 'errors': 0, 'seconds': 0.0, 'max': 0.0}
+        metrics['calls'] += 1
+        metrics['errors'] += 0 if ok else 1
+        metrics['seconds'] += seconds
+        metrics['max'] = max(metrics['max'], seconds)
+
+    def print_metrics(self):
+        for func, metrics in sorted(self.metrics.items(), key=lambda x: -x[1]['seconds']):
+            print('{}: {} calls ({} errors), {:.2f} s total, {:.3f} s mean, {:.3f} s max'.format(
+                func, metrics['calls'], metrics['errors'], metrics['seconds'],
+                metrics['seconds'] / metrics['calls'], metrics['max']))
+
+    def call(self, func, args, compress=False, stream=False):
+        """
+        Call the data server.
+
+        :param compress: gzip the request body, if the server accepts it. Until a gzipped request succeeds, one
+            rejected as a bad request (400 or 415) is sent again uncompressed; if that succeeds, requests are no
+            longer gzipped.
+        :param stream: decode the response incrementally as it is downloaded (if ijson is installed), so the raw
+            response is never held in memory in full; this is for very large responses, such as networks with data
+        """
 
         data = json.dumps({func: args})
 
         headers = {'Content-Type': 'application/json', 'appname': self.app_name}
         cookie = {'beaker.session.id': self.session_id if func != 'login' else None, 'appname:': self.app_name}
-        response = post(self.url, data=data, headers=headers, cookies=cookie, timeout=500)
 
+        t0 = time.time()
+        response = None
+        try:
+            retried = False
+            if compress and self.accepts_gzip is not False:
+                gzip_headers = dict(headers, **{'Content-Encoding': 'gzip'})
+                response = self.post(gzip.compress(data.encode()), gzip_headers, cookie, idempotent=is_read(func))
+                if response.ok:
+                    self.accepts_gzip = True
+                elif response.status_code in GZIP_UNSUPPORTED and not self.accepts_gzip:
+                    retried = True  # the server rejected the request unread, so send it once more, uncompressed
+                    response = None
+            if response is None:
+                response = self.post(data, headers, cookie, stream=stream, idempotent=is_read(func))
+                if retried and response.ok:
+                    self.accepts_gzip = False
+            return self.parse_response(response, func, data, stream=stream)
+        finally:
+            self.record(func, time.time() - t0, ok=response is not None and response.ok)
+
+    @staticmethod
+    def decode(response, stream=False):
+        if stream and ijson is not None:
+            response.raw.decode_content = True  # i.e., if the server gzipped it
+            return next(ijson.items(response.raw, '', map_type=JSONObject, use_float=True))
+        return json.loads(response.content.decode(), object_hook=JSONObject)
+
+    def parse_response(self, response, func, data, stream=False):
+
+        content = None
         if not response.ok:
             try:
                 content = json.loads(response.content.decode(), object_hook=JSONObject)
@@ -113,12 +287,46 @@ class connection(object):
                 else:
                     print("Something went wrong. An unknown server has occurred.")
         else:
-            content = json.loads(response.content.decode(), object_hook=JSONObject)
+            content = self.decode(response, stream=stream)
             if func == 'login':
                 self.session_id = response.cookies['beaker.session.id']
 
         return content
 
+    def call_batch(self, calls, stream=False):
+        """
+        Make several calls, as (func, args) pairs, in one request if batches are enabled (with --batch) and the
+        server accepts them (a JSON list of calls, answered with a list of results in the same order). Otherwise,
+        the calls are made one by one. Batches are only given up on for good if the server answers one as
+        unsupported; after any other failure, the calls are just made one by one this time.
+
+        :return: the results, in the same order as the calls
+        """
+
+        calls = list(calls)
+        if len(calls) > 1 and self.accepts_batch is not False:
+            data = json.dumps([{func: args} for func, args in calls])
+            headers = {'Content-Type': 'application/json', 'appname': self.app_name}
+            cookie = {'beaker.session.id': self.session_id, 'appname:': self.app_name}
+
+            t0 = time.time()
+            response = self.post(data, headers, cookie, stream=stream,
+                                 idempotent=all(is_read(func) for func, args in calls))
+            results = None
+            if response.ok:
+                try:
+                    results = self.decode(response, stream=stream)
+                except ValueError:
+                    pass
+            self.record('batch', time.time() - t0, ok=response.ok)
+            if type(results) == list and len(results) == len(calls):
+                self.accepts_batch = True
+                return results
+            if response.status_code in BATCH_UNSUPPORTED:
+                self.accepts_batch = False
+
+        return [self.call(func, args, stream=stream) for func, args in calls]
+
     def get_basic_network(self):
         if self.filename:
             return self.network
@@ -134,6 +342,46 @@ class connection(object):
     #         return self.call('get_template_attributes', {'template_id': self.template.id})
     #
 
+    def get_scenarios(self, scenario_ids, required=True):
+        """
+        Get scenarios with data. Scenarios not yet loaded are fetched together, in as few requests as possible, and
+        remembered for the rest of the run. A scenario that fails in a batch is fetched again on its own.
+
+        :param required: raise an error if a scenario can't be fetched (otherwise, it is None)
+        """
+        missing = [sid for sid in set(scenario_ids) if sid not in self.scenarios]
+        if missing:
+            responses = self.call_batch([('get_scenario', {'scenario_id': sid}) for sid in missing])
+            for sid, scenario in zip(missing, responses):
+                if len(missing) > 1 and not (scenario and 'faultcode' not in scenario):
+                    scenario = self.call('get_scenario', {'scenario_id': sid})
+                if scenario and 'faultcode' not in scenario:
+                    self.scenarios[sid] = scenario
+                elif required:
+                    raise Exception('Could not get scenario {}: {}'.format(
+                        sid, scenario.get('faultstring') if scenario else 'no response'))
+        return [self.scenarios.get(sid) for sid in scenario_ids]
+
+    def get_scenario(self, scenario_id):
+        return self.get_scenarios([scenario_id])[0]
+
+    def prefetch_ancestors(self, scenario_ids, all_scenarios):
+        """
+        Get the parents, grandparents, etc. of the given scenarios up front, using the parent links of all the
+        network's scenarios (as from the basic network), so no scenario is fetched just to find its parent.
+        """
+        lookup = {s.id: s for s in all_scenarios}
+        ancestors = set()
+        for scenario_id in scenario_ids:
+            scenario = lookup.get(scenario_id)
+            while scenario is not None:
+                parent_id = (scenario.get('layout') or {}).get('parent')
+                if not parent_id or parent_id in ancestors:
+                    break
+                ancestors.add(parent_id)
+                scenario = lookup.get(parent_id)
+        self.get_scenarios(sorted(ancestors), required=False)
+
     def get_res_attr_data(self, **kwargs):
         res_attr_data = self.call(
             'get_resource_attribute_data',
@@ -152,12 +400,27 @@ class connection(object):
         self.call('login', {'username': username, 'password': password})
         return
 
-    def dump_results(self, resource_scenario):
-        return self.call('update_scenario', {'scen': resource_scenario, 'return_summary': 'Y'})
+    def dump_results(self, resource_scenario, compress=False):
+        return self.call('update_scenario', {'scen': resource_scenario, 'return_summary': 'Y'}, compress=compress)
 
 
 class JSONObject(dict):
-    def __init__(self, obj_dict):
-        for k, v in obj_dict.items():
-            self[k] = v
-            setattr(self, k, v)
+    """A dict whose items can also be read (and set) as attributes. Items are stored once, in the dict."""
+
+    def __init__(self, obj_dict=None):
+        super(JSONObject, self).__init__(obj_dict or {})
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+    def __delattr__(self, name):
+        try:
+            del self[name]
+        except KeyError:
+            raise AttributeError(name)
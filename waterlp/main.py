@@ -5,11 +5,17 @@ import shutil
 import sys
 import getpass
 
-from waterlp.tasks import run_model
 from waterlp.parser import commandline_parser
 
 if __name__ == '__main__':
+    if sys.argv[1:2] == ['bundle']:
+        from waterlp.bundle import main as bundle
+        bundle(sys.argv[2:])
+        sys.exit()
+
     try:
+        from waterlp.tasks import run_model
+
         parser = commandline_parser()
         args, unknown = parser.parse_known_args(sys.argv[1:])
 
@@ -2,8 +2,11 @@ import hashlib
 import json
 import sys
 import traceback
+from io import StringIO
+from bisect import bisect_left, bisect_right
 from copy import copy
 from calendar import isleap
+from datetime import datetime, timezone
 import pandas
 import numpy
 import pendulum
@@ -193,6 +196,90 @@ def eval_timeseries(timeseries, dates, fill_value=None, fill_method=None, flatte
     return result
 
 
+def eval_timeseries_array(timeseries, dates_as_string, fill_value=None, date_format='%Y-%m-%d %H:%M:%S'):
+    """
+    Parse a timeseries, with any blocks summed, into an array aligned to dates_as_string.
+    Dates missing from the timeseries are NaN.
+    """
+    try:
+        df = pandas.read_json(StringIO(timeseries) if type(timeseries) == str else timeseries)
+        if df.empty:
+            return numpy.zeros(len(dates_as_string))
+        if fill_value is not None:
+            df.fillna(value=fill_value, inplace=True)
+        series = df.sum(axis=1)
+        series.index = series.index.strftime(date_format=date_format)
+        return series.reindex(dates_as_string).values.astype(float)
+
+    except:
+        raise Exception('Error parsing timeseries data')
+
+
+def periodic_label(date):
+    """Strip the year from a date string or timestamp (ms), leaving a 'MM-DD HH:MM:SS' label."""
+    if type(date) in (int, float) or type(date) == str and date.isdigit():
+        date = datetime.fromtimestamp(int(date) / 1000, tz=timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    return '{} {}'.format(date[5:10], date[11:19] or '00:00:00')
+
+
+def make_periodic_labels(dates_as_string, periodic_timesteps, daily=False):
+    """
+    Get the periodic labels of a compact periodic array, and the index into it of each run date.
+
+    Periodic time steps are positions within the year, so these are used as is, except for daily time steps, which
+    are keyed by month and day instead, since a day's position shifts after Feb 29 in leap years. Feb 29 itself
+    takes Feb 28's value, as periodic timeseries (in the years 9998/9999) have no Feb 29.
+
+    :return: the labels, in compact array order, and the index of each date
+    """
+    if daily:
+        positions = {}
+        index = []
+        for date in dates_as_string:
+            label = periodic_label(date)
+            if label.startswith('02-29'):
+                label = '02-28' + label[5:]
+            if label not in positions:
+                positions[label] = len(positions)
+            index.append(positions[label])
+        return list(positions), numpy.array(index, dtype=int)
+
+    nperiods = max(periodic_timesteps) if periodic_timesteps else 0
+    labels = [None] * nperiods
+    remaining = nperiods
+    for date, pt in zip(dates_as_string, periodic_timesteps):
+        if labels[pt - 1] is None:
+            labels[pt - 1] = periodic_label(date)
+            remaining -= 1
+            if not remaining:
+                break
+    return labels, numpy.array(periodic_timesteps, dtype=int) - 1
+
+
+def eval_periodic_timeseries(timeseries, periodic_labels, fill_value=0):
+    """
+    Parse a periodic timeseries (dates labeled with the years 9998/9999) into a compact array, in the order of
+    periodic_labels (see make_periodic_labels). Blocks, if any, are summed.
+    """
+    try:
+        data = json.loads(timeseries) if type(timeseries) == str else timeseries
+        by_label = {}
+        for values in (data or {}).values():
+            for date, value in values.items():
+                if value is None:
+                    continue
+                label = periodic_label(date)
+                by_label[label] = by_label.get(label, 0) + value
+        return numpy.array([by_label.get(label, fill_value) for label in periodic_labels], dtype=float)
+    except:
+        raise Exception('Error parsing periodic timeseries data')
+
+
+def expand_periodic(compact, periodic_index):
+    """Expand a compact periodic array to the run horizon with a single gather."""
+    return compact[periodic_index]
+
+
 def eval_array(array, flavor=None):
     result = None
     try:
@@ -301,8 +388,9 @@ def make_default_value(data_type='timeseries', dates=None, nblocks=1, flavor='js
         if data_type == 'timeseries':
             default_eval_value = empty_data_timeseries(dates, nblocks=nblocks, flavor=flavor, date_format=date_format)
         elif data_type == 'periodic timeseries':
-            dates = [pendulum.parse(d) for d in dates]
-            periodic_dates = [d.replace(year=9999).to_datetime_string() for d in dates if (d - dates[0]).in_years() < 1]
+            # ISO-formatted strings compare chronologically, so there is no need to parse each date
+            one_year_later = '{:04}{}'.format(int(dates[0][:4]) + 1, dates[0][4:])
+            periodic_dates = ['9999' + d[4:] for d in dates if d < one_year_later]
             default_eval_value = empty_data_timeseries(periodic_dates, nblocks=nblocks)
         elif data_type == 'array':
             default_eval_value = '[[],[]]'
@@ -341,6 +429,9 @@ class Evaluator:
                  date_format='%Y-%m-%d %H:%M:%S'):
         self.conn = conn
         self.dates_as_string, self.dates, self.periodic_timesteps = make_dates(settings, data_type=data_type)
+        timestep = (settings.get('time_step') or settings.get('timestep') or '').lower()
+        self.periodic_labels, self.periodic_index = make_periodic_labels(self.dates_as_string, self.periodic_timesteps,
+                                                                         daily=timestep == 'day')
         self.date_format = date_format
         self.start_date = self.dates[0]
         self.end_date = self.dates[-1]
@@ -378,6 +469,27 @@ class Evaluator:
         # each evaluation or run this can store as much as possible for reuse.
         self.store = {}
         self.hashstore = {}
+        self.periodic_store = {}
+        self.results = None  # model results table, once bound
+
+    def eval_periodic(self, value, fill_value=0):
+        """Evaluate a periodic timeseries dataset as a compact array, indexed by periodic_index"""
+        return eval_periodic_timeseries(value.value, self.periodic_labels, fill_value=fill_value)
+
+    def expand_periodic(self, compact):
+        """Expand a compact periodic array to the full run horizon"""
+        return expand_periodic(compact, self.periodic_index)
+
+    def get_periodic(self, key, rs_value):
+        """Get (and remember) the compact array for a periodic dataset, or None if it is a function"""
+        if key not in self.periodic_store:
+            compact = None
+            if rs_value.get('value') is not None:
+                metadata = json.loads(rs_value.get('metadata') or '{}')
+                if metadata.get('use_function', 'N') != 'Y':
+                    compact = self.eval_periodic(rs_value)
+            self.periodic_store[key] = compact
+        return self.periodic_store[key]
 
     def eval_data(self, value, func=None, flavor=None, depth=0, flatten=False, fill_value=None,
                   tsidx=None, date_format=None, has_blocks=False, data_type=None, parentkey=None, for_eval=False):
@@ -535,19 +647,20 @@ class Evaluator:
 
             # get dates to be evaluated
             if tsidx is not None:
-                dates = self.dates[tsidx:tsidx + 1]
+                t0, t1 = tsidx, tsidx + 1
             else:
                 tsi = getattr(self, 'tsi', None)
                 tsf = getattr(self, 'tsf', None)
                 if tsi is not None and tsf is not None:
-                    dates = self.dates[tsi:tsf]  # used when running model
+                    t0, t1 = tsi, tsf  # used when running model
                 else:
-                    dates = self.dates  # used when evaluating a function in app
+                    t0, t1 = 0, len(self.dates)  # used when evaluating a function in app
 
-            for date in dates:
-                date_as_string = date.to_datetime_string()
-                timestep = self.dates_as_string.index(date_as_string) + 1
-                periodic_timestep = self.periodic_timesteps[timestep - 1]
+            for t in range(max(t0, 0), min(t1, len(self.dates))):
+                date = self.dates[t]
+                date_as_string = self.dates_as_string[t]
+                timestep = t + 1
+                periodic_timestep = self.periodic_timesteps[t]
                 water_year = date.year + (0 if date.month < self.start_date.month else 1)
                 value = getattr(self.namespace, hashkey)(
                     self,
@@ -703,10 +816,32 @@ class Evaluator:
             # calculate offset
             offset_date_as_string = None
             if offset:
-                offset_timestep = self.dates.index(date) + offset + 1
+                offset_timestep = (timestep or self.dates.index(date) + 1) + offset
             else:
                 offset_timestep = timestep
 
+            # periodic data is looked up in its compact array by periodic time step
+            if rs_value['type'] == 'periodic timeseries' and key != parentkey:
+                compact = self.get_periodic(key, rs_value)
+                if compact is not None:
+                    if start or end:
+                        start = start or date
+                        end = end or date
+                        start_as_string = start if type(start) == str else start.to_datetime_string()
+                        end_as_string = end if type(end) == str else end.to_datetime_string()
+                        i0 = bisect_left(self.dates_as_string, start_as_string)
+                        i1 = bisect_right(self.dates_as_string, end_as_string)
+                        vals = compact[self.periodic_index[i0:i1]]
+                        if not len(vals):
+                            result = None
+                        elif agg == 'sum':
+                            result = float(numpy.sum(vals))
+                        else:
+                            result = float(numpy.mean(vals))
+                    elif 1 <= offset_timestep <= len(self.dates):
+                        result = float(compact[self.periodic_index[offset_timestep - 1]])
+                    return result if result is not None else default
+
             if offset_timestep < 1 or offset_timestep > len(self.dates):
                 pass
             elif not (start or end):  # TODO: change this when start/end are added to key
@@ -715,7 +850,14 @@ class Evaluator:
                     offset_date = self.dates[offset_timestep - 1]
                     offset_date_as_string = offset_date.to_datetime_string()
 
-                    stored_result = self.store[key].get(offset_date_as_string)
+                    stored = self.store[key]
+                    if isinstance(stored, numpy.ndarray):  # source data held as an array aligned to the run dates
+                        stored_result = stored[offset_timestep - 1]
+                        stored_result = None if stored_result != stored_result else float(stored_result)
+                    else:
+                        stored_result = stored.get(offset_date_as_string)
+                    if stored_result is None and self.results is not None:
+                        stored_result = self.results.get(key, offset_timestep - 1)
 
                 elif rs_value['type'] in ['scalar', 'array', 'descriptor']:
                     stored_result = self.store[key]
@@ -0,0 +1,161 @@
+import os
+import json
+from math import ceil
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+import numpy
+
+from waterlp.models.evaluator import eval_timeseries_array
+
+PARSE_MODES = ['serial', 'thread', 'process']
+
+# set once per parsing worker, so the run dates aren't sent with every chunk
+_parse_dates = None
+_parse_date_format = None
+
+
+class SourceTable(object):
+    """
+    Effective resource attribute data collected from layered source scenarios.
+
+    There is one integer-indexed row per resource attribute. A resource attribute seen again in a later source
+    scenario overwrites its existing row, so the table only ever holds effective values. An empty value in a later
+    source scenario doesn't overwrite an earlier one.
+    """
+
+    def __init__(self):
+        self.rows = {}  # resource attribute ID -> row
+        self.res_attr_ids = []
+        self.keys = []  # (resource_type, resource_id, attr_id)
+        self.source_ids = []
+        self.resource_scenarios = []
+        self._metadata = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, res_attr_id, key, source_id, rs):
+        row = self.rows.get(res_attr_id)
+        if row is None:
+            self.rows[res_attr_id] = len(self.keys)
+            self.res_attr_ids.append(res_attr_id)
+            self.keys.append(key)
+            self.source_ids.append(source_id)
+            self.resource_scenarios.append(rs)
+            self._metadata.append(None)
+        elif rs.value.value not in (None, ''):
+            self.source_ids[row] = source_id
+            self.resource_scenarios[row] = rs
+            self._metadata[row] = None
+
+    def metadata(self, row):
+        """The dataset metadata of a row, parsed on first use"""
+        if self._metadata[row] is None:
+            self._metadata[row] = json.loads(self.resource_scenarios[row].value.metadata or '{}')
+        return self._metadata[row]
+
+    def values(self):
+        """A lookup of (resource_type, resource_id, attr_id) to effective dataset value"""
+        return {key: rs.value for key, rs in zip(self.keys, self.resource_scenarios)}
+
+
+def ingest_source_data(sources, res_index, res_tattrs, network_id):
+    """
+    Collect resource scenarios from layered source scenarios in a single pass.
+
+    :param sources: (source_id, source scenario) pairs, from the baseline to the most specific scenario
+    :param res_index: lookup of resource attribute ID to (resource_type, resource_id); anything else is the network
+    :param res_tattrs: lookup of resource attribute ID to template type attribute
+    :param network_id: the network ID
+    :return: a SourceTable
+    """
+
+    table = SourceTable()
+    network_idx = ('network', network_id)
+
+    for source_id, source in sources:
+        for rs in source.resourcescenarios:
+            res_attr_id = rs.resource_attr_id
+            if res_attr_id not in res_tattrs:
+                continue  # this is for a different resource type
+            resource_type, resource_id = res_index.get(res_attr_id, network_idx)
+            table.add(res_attr_id, (resource_type, resource_id, rs.attr_id), source_id, rs)
+
+    return table
+
+
+def is_output(tattr):
+    """Whether a template type attribute is a (non-intermediary) output, which isn't pre-processed"""
+    return tattr['is_var'] == 'Y' and not tattr['properties'].get('intermediary', False)
+
+
+def timeseries_items(table, exclude=(), tattrs=None):
+    """
+    The plain (not function) timeseries in a SourceTable, as (row, timeseries JSON) pairs for parse_source_data.
+    With tattrs (a lookup of (resource_type, resource_id, attr_id) to template type attribute), only inputs and
+    intermediary outputs are included.
+    """
+    return [(row, rs.value.value) for row, rs in enumerate(table.resource_scenarios)
+            if rs.value.type == 'timeseries' and row not in exclude
+            and (tattrs is None or tattrs.get(table.keys[row]) and not is_output(tattrs[table.keys[row]]))
+            and table.metadata(row).get('use_function', 'N') != 'Y']
+
+
+def _init_parser(dates_as_string, date_format):
+    global _parse_dates, _parse_date_format
+    _parse_dates = dates_as_string
+    _parse_date_format = date_format
+
+
+def _parse_chunk(chunk):
+    rows, timeseries = chunk
+    values = numpy.empty((len(rows), len(_parse_dates)))
+    for i, ts in enumerate(timeseries):
+        values[i] = eval_timeseries_array(ts, _parse_dates, fill_value=0, date_format=_parse_date_format)
+    return rows, values
+
+
+def parse_source_data(items, dates_as_string, date_format, mode='serial', workers=None, chunksize=None):
+    """
+    Parse timeseries datasets into arrays aligned to the run dates, optionally fanned out to a pool.
+
+    Each chunk comes back as a single 2-d array rather than as pickled dictionaries. Results are keyed by row, so
+    the layered overrides already resolved in the SourceTable are unaffected by the order chunks finish in.
+
+    :param items: (row, timeseries JSON) pairs
+    :param dates_as_string: the run dates
+    :param date_format: the format of the run dates
+    :param mode: 'serial', 'thread' or 'process'
+    :param workers: the number of pool workers (defaults to the number of CPUs)
+    :param chunksize: the number of datasets per chunk
+    :return: a lookup of row to array (NaN where the timeseries has no value)
+    """
+
+    if mode not in PARSE_MODES:
+        raise Exception('Unknown parse mode "{}". Options are {}.'.format(mode, ', '.join(PARSE_MODES)))
+
+    items = list(items)
+    if not items:
+        return {}
+
+    workers = workers or os.cpu_count() or 1
+    chunksize = chunksize or max(1, ceil(len(items) / (workers * 4)))
+    chunks = []
+    for i in range(0, len(items), chunksize):
+        rows, timeseries = zip(*items[i:i + chunksize])
+        chunks.append((rows, timeseries))
+
+    parsed = {}
+    if mode == 'serial' or workers == 1:
+        _init_parser(dates_as_string, date_format)
+        results = map(_parse_chunk, chunks)
+        for rows, values in results:
+            parsed.update(zip(rows, values))
+    else:
+        pool_class = ThreadPool if mode == 'thread' else Pool
+        with pool_class(workers, initializer=_init_parser, initargs=(dates_as_string, date_format)) as pool:
+            for rows, values in pool.imap(_parse_chunk, chunks):
+                parsed.update(zip(rows, values))
+
+    return parsed
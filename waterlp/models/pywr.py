@@ -31,6 +31,20 @@ link_types = {
     'River': River,
 }
 
+# the primitive parameters behind everything update_param sets
+NODE_PARAMS = ('min_flow', 'max_flow', 'cost')
+STORAGE_PARAMS = ('min_volume', 'max_volume', 'cost')
+
+
+def node_state(node):
+    """
+    A node's primitive parameters, as (node, attribute, value), including those of each sublink of a piecewise link
+    (e.g., hydropower), whose own parameters (base flow, turbine capacity, etc.) are derived from its sublinks.
+    """
+    parts = getattr(node, 'sublinks', None) or [node]
+    attrs = STORAGE_PARAMS if isinstance(node, Storage) else NODE_PARAMS
+    return [(part, attr, getattr(part, attr)) for part in parts for attr in attrs]
+
 
 # create the model
 class PywrModel(object):
@@ -40,6 +54,7 @@ class PywrModel(object):
         self.storage = {}
         self.non_storage = {}
         self.updated = {} # dictionary for debugging whether or not a param has been updated
+        self.initial_params = {}  # node ID -> build-time state (see node_state), for reuse
 
         self.create_model(network, template, initial_volumes=initial_volumes)
 
@@ -204,6 +219,9 @@ class PywrModel(object):
 
     def setup(self, start, end, step):
 
+        # a reused model starts from its build-time parameters, not from values set by the last run
+        self.reset_params()
+
         self.update_timesteps(
             start=start,
             end=end,
@@ -237,39 +255,51 @@ class PywrModel(object):
         ta = (type_name, attr_name)
 
         if ta == ('catchment', 'runoff'):
-            self.non_storage[res_idx].flow = value
+            self.set_param(self.non_storage[res_idx], 'flow', value)
         elif 'demand' in type_name:
             if attr_name == 'value':
-                self.non_storage[res_idx].cost = -value
+                self.set_param(self.non_storage[res_idx], 'cost', -value)
             elif attr_name == 'demand':
-                self.non_storage[res_idx].max_flow = value
+                self.set_param(self.non_storage[res_idx], 'max_flow', value)
         elif type_name == 'flow requirement':
             if attr_name == 'requirement':
-                self.non_storage[res_idx].mrf = value
+                self.set_param(self.non_storage[res_idx], 'mrf', value)
             elif attr_name == 'violation cost':
-                self.non_storage[res_idx].mrf_cost = -value
+                self.set_param(self.non_storage[res_idx], 'mrf_cost', -value)
         if type_name == 'hydropower':
             if attr_name == 'water demand':
-                self.non_storage[res_idx].base_flow = value
+                self.set_param(self.non_storage[res_idx], 'base_flow', value)
             elif attr_name == 'base value':
-                self.non_storage[res_idx].base_cost = -value
+                self.set_param(self.non_storage[res_idx], 'base_cost', -value)
             elif attr_name == 'turbine capacity':
-                self.non_storage[res_idx].turbine_capacity = value
+                self.set_param(self.non_storage[res_idx], 'turbine_capacity', value)
             elif attr_name == 'excess value':
-                self.non_storage[res_idx].excess_cost = -value
+                self.set_param(self.non_storage[res_idx], 'excess_cost', -value)
         elif attr_name == 'storage demand':
-            self.storage[resource_id].max_volume = value
+            self.set_param(self.storage[resource_id], 'max_volume', value)
         elif attr_name == 'storage value':
-            self.storage[resource_id].cost = -value
+            self.set_param(self.storage[resource_id], 'cost', -value)
         elif attr_name == 'storage capacity':
-            self.storage[resource_id].max_volume = value
+            self.set_param(self.storage[resource_id], 'max_volume', value)
         elif attr_name == 'inactive pool':
-            self.storage[resource_id].min_volume = value
+            self.set_param(self.storage[resource_id], 'min_volume', value)
         elif attr_name == 'flow capacity':
-            self.non_storage[res_idx].max_flow = value
+            self.set_param(self.non_storage[res_idx], 'max_flow', value)
 
         return
 
+    def set_param(self, node, attr, value):
+        """Set a node parameter, first remembering the node's build-time state"""
+        if id(node) not in self.initial_params:
+            self.initial_params[id(node)] = node_state(node)
+        setattr(node, attr, value)
+
+    def reset_params(self):
+        """Restore every node changed since the model was built to its build-time state"""
+        for state in self.initial_params.values():
+            for part, attr, value in state:
+                setattr(part, attr, value)
+
     # def init_params(self, params, variables, block_params):
     #
     #     for param_name, param in params.items():
@@ -0,0 +1,170 @@
+import os
+import tempfile
+
+import numpy
+
+try:
+    import resource
+except ImportError:
+    resource = None  # not available on Windows
+
+# model outputs collected at each time step
+FLOW = 'flow'  # flow through a non-storage node or link
+VOLUME = 'volume'  # storage volume
+STORAGE_INFLOW = 'storage inflow'  # total flow from a storage node's outputs (i.e., into the storage)
+STORAGE_OUTFLOW = 'storage outflow'  # total flow from a storage node's inputs (i.e., out of the storage)
+
+
+def read_output(node, kind):
+    if kind == FLOW:
+        return node.flow[0]
+    elif kind == VOLUME:
+        return node.volume[0]
+    elif kind == STORAGE_OUTFLOW:
+        return sum([input.flow[0] for input in node.inputs])  # "input" means "input to the system"
+    elif kind == STORAGE_INFLOW:
+        return sum([output.flow[0] for output in node.outputs])
+
+
+def peak_memory_mb():
+    """The peak resident memory of this process so far, in MB"""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # ru_maxrss is in KB on Linux
+
+
+class ResultTable(object):
+    """
+    Model results, bound once after the model is built.
+
+    Each bound output (a Pywr node and what to read from it) has a preallocated row, with one column per run date,
+    and its unit conversion factor resolved up front. Collecting results is then one array write per time step.
+
+    With flush_every, only that many time steps are kept in memory. Each time the in-memory window is full, it is
+    spilled to a memory-mapped file (in spill_dir, or the system temp directory) and reused, so memory stays bounded
+    however long the run is. Stored input values ({date: value} in the system store) bound with bind_stored are spilled
+    to the same file, and removed from the store, as their dates are flushed.
+    """
+
+    def __init__(self, ndates, flush_every=None, spill_dir=None):
+        self.ndates = ndates
+        self.keys = []  # result keys, as 'resource_type/resource_id/attr_id'
+        self.rows = {}  # result key -> row
+        self.outputs = []  # (pywr node, kind)
+        self.has_blocks = []
+        self._factors = []
+        self.factors = None
+        self.values = None
+        self.written = 0  # the number of time steps collected so far
+        self.window = flush_every if flush_every and flush_every < ndates else ndates
+        self.spill_dir = spill_dir
+        self.spill_path = None
+        self.flushed = 0  # the number of time steps spilled to the spill file
+        self._spill = None  # a read-only view of the spill file, opened as needed
+        self.stored = []  # keys of stored input values, spilled from the store when flushing
+        self.store = None
+        self.dates_as_string = None
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def output_keys(self):
+        return self.keys[:len(self.keys) - len(self.stored)]
+
+    def bind(self, key, node, kind, factor, has_blocks=False):
+        if key in self.rows:
+            return
+        self.rows[key] = len(self.keys)
+        self.keys.append(key)
+        self.outputs.append((node, kind))
+        self.has_blocks.append(has_blocks)
+        self._factors.append(numpy.nan if factor is None else factor)
+
+    def bind_stored(self, key):
+        """Bind a stored input value to a row. Model outputs must all be bound first."""
+        if key in self.rows:
+            return
+        self.rows[key] = len(self.keys)
+        self.keys.append(key)
+        self.stored.append(key)
+
+    def bind_store(self, store, dates_as_string):
+        """The store to spill stored input values from, and the run dates it is keyed by"""
+        self.store = store
+        self.dates_as_string = dates_as_string
+
+    def allocate(self):
+        self.factors = numpy.array(self._factors, dtype=float)
+        self.values = numpy.full((len(self.keys), self.window), numpy.nan)
+        del self._factors
+
+        if self.window < self.ndates and self.keys:
+            fd, self.spill_path = tempfile.mkstemp(prefix='waterlp-results-', suffix='.dat', dir=self.spill_dir)
+            os.close(fd)
+            # size the spill file
+            numpy.memmap(self.spill_path, dtype=float, mode='w+', shape=(len(self.keys), self.ndates)).flush()
+
+    def collect(self, tsidx):
+        raw = numpy.fromiter((read_output(node, kind) for node, kind in self.outputs), dtype=float,
+                             count=len(self.outputs))
+        self.values[:len(self.outputs), tsidx - self.flushed] = raw * self.factors
+        self.written = max(self.written, tsidx + 1)
+        if self.spill_path and self.written - self.flushed == self.window:
+            self.flush()
+
+    def flush(self):
+        """Spill the collected time steps still in memory to the spill file, and reset the in-memory window"""
+        n = self.written - self.flushed
+        if not self.spill_path or not n:
+            return
+        self._spill = None
+        spill = numpy.memmap(self.spill_path, dtype=float, mode='r+', shape=(len(self.keys), self.ndates))
+        spill[:, self.flushed:self.written] = self.values[:, :n]
+        if self.store is not None:
+            dates = self.dates_as_string[self.flushed:self.written]
+            for key in self.stored:
+                values = self.store.get(key)
+                if values:
+                    spill[self.rows[key], self.flushed:self.written] = [values.pop(d, numpy.nan) for d in dates]
+        spill.flush()
+        del spill
+        self.flushed = self.written
+        self.values[:] = numpy.nan
+
+    def _spilled(self):
+        if self._spill is None:
+            self._spill = numpy.memmap(self.spill_path, dtype=float, mode='r', shape=(len(self.keys), self.ndates))
+        return self._spill
+
+    def get(self, key, tsidx):
+        row = self.rows.get(key)
+        if row is None or not 0 <= tsidx < self.written:
+            return None
+        if tsidx < self.flushed:
+            val = self._spilled()[row, tsidx]
+        else:
+            val = self.values[row, tsidx - self.flushed]
+        return None if val != val else float(val)
+
+    def row_values(self, row):
+        """All collected values of a row, as an array"""
+        values = self.values[row, :self.written - self.flushed]
+        if self.flushed:
+            values = numpy.concatenate([self._spilled()[row, :self.flushed], values])
+        return values
+
+    def close(self):
+        """Remove the spill file, if any"""
+        self._spill = None
+        if self.spill_path and os.path.exists(self.spill_path):
+            os.remove(self.spill_path)
+        self.spill_path = None
+
+    def __getstate__(self):
+        # the Pywr nodes are bound to a model in this process only
+        state = self.__dict__.copy()
+        state['outputs'] = []
+        state['_spill'] = None
+        state['store'] = None
+        return state
@@ -1,13 +1,28 @@
 import os
 import json
+import time
+import tempfile
+from functools import partial
 from attrdict import AttrDict
-import pandas as pd
-import boto3
+import numpy
 import pendulum
 
-from waterlp.models.pywr import PywrModel
 from waterlp.models.evaluator import Evaluator
-from waterlp.utils.converter import convert
+from waterlp.models.ingestion import ingest_source_data, parse_source_data, timeseries_items, is_output
+from waterlp.models.variations import VariationOverlay, perturb
+from waterlp.models.results import ResultTable, FLOW, VOLUME, STORAGE_INFLOW, STORAGE_OUTFLOW, peak_memory_mb
+from waterlp.utils.converter import convert, conversion_factor
+from waterlp.utils.uploads import ResultUploader, serialize_series, serialize_array
+from waterlp.utils.local_results import RESULTS_FILE, values_to_array, write_results
+from waterlp.utils.object_store import get_backend, upload_file
+from waterlp.utils.cache import revision_token
+from waterlp.utils.model_cache import models, current_memory_mb
+
+# units used by the Pywr model, by dimension
+MODEL_UNITS = {
+    'Volume': 'hm^3',
+    'Volumetric flow rate': 'hm^3 day^-1',
+}
 
 INITIAL_STORAGE_ATTRS = [
     ('Reservoir', 'Initial Storage'),
@@ -15,31 +30,6 @@ INITIAL_STORAGE_ATTRS = [
 ]
 
 
-def perturb(val, variation):
-    # NB: this is made explicit to avoid using exec
-    operator = variation['operator']
-    value = variation['value']
-    if operator == 'multiply':
-        if type(val) == dict:
-            for c, vals in val.items():
-                for i, v in vals.items():
-                    if val[c][i] is not None:
-                        val[c][i] *= value
-        else:
-            return val * value
-    elif operator == 'add':
-        if type(val) == dict:
-            for c, vals in val.items():
-                for i, v in vals.items():
-                    if val[c][i] is not None:
-                        val[c][i] = value
-
-        else:
-            return val + value
-    else:
-        return val
-
-
 def add_subblocks(self, values, attr_name):
     subblocks = self.default_subblocks
     nsubblocks = self.nsubblocks
@@ -109,11 +99,13 @@ class WaterSystem(object):
 
         self.constants = {}  # fixed (scalars, arrays, etc.)
         self.variables = {}  # variable (time series)
+        self.overlay = VariationOverlay()  # subscenario variations, applied on read
         self.initial_conditions = {}
         # self.block_params = ['Storage Demand', 'Demand', 'Priority']
         self.block_params = []
         self.blocks = {'node': {}, 'link': {}, 'network': {}}
         self.store = {}
+        self.results = None  # model results, bound once the model is built
         self.res_scens = {}
 
         self.params = {}  # to be defined later
@@ -176,8 +168,10 @@ class WaterSystem(object):
         # initialize dictionary of parameters
         self.scalars = {feature_type: {} for feature_type in ['node', 'link', 'net']}
 
-        self.ra_node = {ra.id: node.id for node in network.nodes for ra in node.attributes}  # res_attr to node lookup
-        self.ra_link = {ra.id: link.id for link in network.links for ra in link.attributes}  # res_attr to link lookup
+        # res_attr to (resource type, resource id) lookup; anything not found belongs to the network
+        self.res_index = {ra.id: ('node', node.id) for node in network.nodes for ra in node.attributes}
+        self.res_index.update({ra.id: ('link', link.id) for link in network.links for ra in link.attributes})
+        self.source_table = None
 
     def create_exception(self, key, message):
 
@@ -252,7 +246,6 @@ class WaterSystem(object):
         tsf = self.foresight_periods
 
         self.evaluator.block_params = self.block_params
-        self.evaluator.rs_values = {}  # to store raw resource attribute values
 
         self.evaluator.tsi = tsi
         self.evaluator.tsf = tsf
@@ -260,192 +253,179 @@ class WaterSystem(object):
         nsubblocks = 1
         self.default_subblocks = list(range(nsubblocks))
 
-        # collect source data
-        for source_id in self.scenario.source_ids:
+        # collect source data, with later source scenarios overriding earlier ones
+        t0 = time.time()
+        sources = ((source_id, self.scenario.source_scenarios[source_id]) for source_id in self.scenario.source_ids)
+        self.source_table = table = ingest_source_data(sources, self.res_index, self.res_tattrs, self.network.id)
+        self.evaluator.rs_values = table.values()  # to store raw resource attribute values
+        if self.args.debug:
+            print('Ingested {} resource attributes in {:.3f} s'.format(len(table), time.time() - t0))
+
+        # timeseries pre-parsed in a bundle only need aligning to the run dates
+        parsed = {}
+        if self.conn.bundle is not None:
+            parsed = self.conn.bundle.parse_rows(table.resource_scenarios, self.dates_as_string)
+
+        # parse plain timeseries datasets up front into aligned arrays, optionally in a thread or process pool
+        # (outputs aren't pre-processed, so they aren't parsed either)
+        t0 = time.time()
+        items = timeseries_items(table, exclude=parsed, tattrs=self.conn.tattrs)
+        parsed.update(parse_source_data(items, self.dates_as_string, self.date_format,
+                                        mode=self.args.parse_mode, workers=self.args.parse_workers))
+        if self.args.debug:
+            print('Parsed {} timeseries ({}) in {:.3f} s'.format(len(items), self.args.parse_mode, time.time() - t0))
 
-            self.evaluator.scenario_id = source_id
+        # evaluate source data
+        for row, rs in enumerate(table.resource_scenarios):
 
-            source = self.scenario.source_scenarios[source_id]
+            self.evaluator.scenario_id = table.source_ids[row]
+            resource_type, resource_id, attr_id = table.keys[row]
+            res_idx = (resource_type, resource_id)
 
-            for rs in source.resourcescenarios:
+            try:
 
-                if rs.resource_attr_id not in self.res_tattrs:
-                    continue  # this is for a different resource type
+                # get attr name
+                tattr = self.conn.tattrs[(resource_type, resource_id, attr_id)]
+                if not tattr:
+                    continue
+                # attr_name = tattr['att']
+                is_var = tattr['is_var'] == 'Y'
 
-                # get identifiers
-                if rs.resource_attr_id in self.ra_node:
-                    resource_type = 'node'
-                    resource_id = self.ra_node[rs.resource_attr_id]
-                elif rs.resource_attr_id in self.ra_link:
-                    resource_type = 'link'
-                    resource_id = self.ra_link[rs.resource_attr_id]
-                else:
-                    resource_type = 'network'
-                    resource_id = self.network.id
+                # non-intermediary outputs should not be pre-processed at all
+                if is_output(tattr):
+                    continue
 
-                self.evaluator.rs_values[(resource_type, resource_id, rs.attr_id)] = rs.value
+                # create a dictionary to lookup resourcescenario by resource attribute ID
+                self.res_scens[rs.resource_attr_id] = rs
 
-        # evaluate source data
-        for source_id in self.scenario.source_ids:
+                # load the metadata
+                metadata = table.metadata(row)
 
-            self.evaluator.scenario_id = source_id
+                # identify as function or not
+                is_function = metadata.get('use_function', 'N') == 'Y'
 
-            source = self.scenario.source_scenarios[source_id]
+                # get data type
+                data_type = rs.value.type
 
-            for rs in source.resourcescenarios:
+                # update data type
+                self.res_tattrs[rs.resource_attr_id]['data_type'] = data_type
 
-                # get identifiers
-                if rs.resource_attr_id in self.ra_node:
-                    resource_type = 'node'
-                    resource_id = self.ra_node[rs.resource_attr_id]
-                elif rs.resource_attr_id in self.ra_link:
-                    resource_type = 'link'
-                    resource_id = self.ra_link[rs.resource_attr_id]
-                else:
-                    resource_type = 'network'
-                    resource_id = self.network.id
-                res_idx = (resource_type, resource_id)
+                # default blocks
+                # NB: self.block_params should be defined
+                # TODO: update has_blocks from template, not metadata
+                # has_blocks = attr_name in self.block_params or metadata.get('has_blocks', 'N') == 'Y'
+                has_blocks = False
+                blocks = [(0, 0)]
 
-                try:
+                type_name = self.resources[(resource_type, resource_id)]['type']['name']
+                tattr_idx = (resource_type, type_name, attr_id)
 
-                    res_tattr = self.res_tattrs.get(rs.resource_attr_id)
-                    if not res_tattr:
-                        continue  # this is for a different resource type
+                parentkey = '{}/{}/{}'.format(resource_type, resource_id, attr_id)
 
-                    # get attr name
-                    attr_id = res_tattr['attr_id']
-                    tattr = self.conn.tattrs[(resource_type, resource_id, attr_id)]
-                    if not tattr:
-                        continue
-                    intermediary = tattr['properties'].get('intermediary', False)
-                    # attr_name = tattr['att']
-                    is_var = tattr['is_var'] == 'Y'
+                # TODO: get fill_value from dataset/ttype (this should be user-specified)
+                self.evaluator.data_type = data_type
+                value = None
+                try:
+                    # Intermediary output functions are not evaluated at this stage, as they may depend on calculated values
+                    # if not (intermediary and is_var and is_function):
+                    if data_type == 'periodic timeseries' and not is_function:
+                        # expand the compact periodic array to the run horizon in one gather
+                        compact = self.evaluator.eval_periodic(rs.value, fill_value=0)
+                        value = self.evaluator.expand_periodic(compact)
+                    elif row in parsed:
+                        value = parsed.pop(row)
+                    elif not (is_var and is_function):
+                        value = self.evaluator.eval_data(
+                            value=rs.value,
+                            fill_value=0,
+                            has_blocks=has_blocks,
+                            date_format=self.date_format,
+                            flavor='native',
+                            parentkey=parentkey
+                        )
+                except:
+                    raise
 
-                    # non-intermediary outputs should not be pre-processed at all
-                    if is_var and not intermediary:
-                        continue
+                if not is_var and (value is None or (type(value) == str and not value)):
+                    continue
 
-                    # create a dictionary to lookup resourcescenario by resource attribute ID
-                    self.res_scens[rs.resource_attr_id] = rs
+                # TODO: add generic unit conversion utility here
+                dimension = rs.value.dimension
 
-                    # load the metadata
-                    metadata = json.loads(rs.value.metadata)
+                if data_type == 'scalar':
+                    try:
+                        value = float(value)
+                    except:
+                        raise Exception("Could not convert scalar")
 
-                    # identify as function or not
-                    is_function = metadata.get('use_function', 'N') == 'Y'
+                    if (type_name, tattr['attr_name']) in INITIAL_STORAGE_ATTRS:
+                        if tattr_idx not in self.initial_volumes:
+                            self.initial_volumes[tattr_idx] = {}
+                        self.initial_volumes[tattr_idx][resource_id] = value
 
-                    # get data type
-                    data_type = rs.value.type
+                    else:
+                        if tattr_idx not in self.constants:
+                            self.constants[tattr_idx] = {}
+                        self.constants[tattr_idx][res_idx] = value
 
-                    # update data type
-                    self.res_tattrs[rs.resource_attr_id]['data_type'] = data_type
 
-                    # default blocks
-                    # NB: self.block_params should be defined
-                    # TODO: update has_blocks from template, not metadata
-                    # has_blocks = attr_name in self.block_params or metadata.get('has_blocks', 'N') == 'Y'
-                    has_blocks = False
-                    blocks = [(0, 0)]
+                elif data_type == 'descriptor':  # this could change later
+                    if tattr_idx not in self.constants:
+                        self.constants[tattr_idx] = {}
+                    self.constants[tattr_idx][res_idx] = value
 
-                    type_name = self.resources[(resource_type, resource_id)]['type']['name']
-                    tattr_idx = (resource_type, type_name, attr_id)
+                elif data_type in ['timeseries', 'periodic timeseries']:
+                    values = value
+                    function = None
 
-                    parentkey = '{}/{}/{}'.format(resource_type, resource_id, attr_id)
+                    # plain timeseries are held as arrays aligned to the run dates (NaN where missing)
+                    if not is_function and type(values) == dict:
+                        values = values_to_array(values, self.dates_as_string)
 
-                    # TODO: get fill_value from dataset/ttype (this should be user-specified)
-                    self.evaluator.data_type = data_type
-                    value = None
                     try:
-                        # Intermediary output functions are not evaluated at this stage, as they may depend on calculated values
-                        # if not (intermediary and is_var and is_function):
-                        if not (is_var and is_function):
-                            value = self.evaluator.eval_data(
-                                value=rs.value,
-                                fill_value=0,
-                                has_blocks=has_blocks,
-                                date_format=self.date_format,
-                                flavor='native',
-                                parentkey=parentkey
-                            )
+                        if is_function:
+                            function = metadata['function']
+                            if not function:  # if there is no function, this will be treated as no dataset
+                                continue
+
+                        # routine to add blocks using quadratic values - this needs to be paired with a similar routine when updating boundary conditions
+                        # if has_blocks:
+                        #     values = add_subblocks(values, attr_name, self.default_subblocks)
+
+                        if tattr_idx not in self.variables:
+                            self.variables[tattr_idx] = {}
+
+                        self.variables[tattr_idx][res_idx] = {
+                            'data_type': data_type,
+                            'values': values,
+                            'is_function': is_function,
+                            'function': function,
+                            'has_blocks': has_blocks,
+                        }
                     except:
                         raise
 
-                    if not is_var and (value is None or (type(value) == str and not value)):
-                        continue
-
-                    # TODO: add generic unit conversion utility here
-                    dimension = rs.value.dimension
-
-                    if data_type == 'scalar':
-                        try:
-                            value = float(value)
-                        except:
-                            raise Exception("Could not convert scalar")
-
-                        if (type_name, tattr['attr_name']) in INITIAL_STORAGE_ATTRS:
-                            if tattr_idx not in self.initial_volumes:
-                                self.initial_volumes[tattr_idx] = {}
-                            self.initial_volumes[tattr_idx][resource_id] = value
-
-                        else:
-                            if tattr_idx not in self.constants:
-                                self.constants[tattr_idx] = {}
-                            self.constants[tattr_idx][res_idx] = value
+                self.store[parentkey] = value
 
+                # update resource blocks to match max of this type block and previous type blocks
+                type_blocks = self.blocks[resource_type]
+                if res_idx in type_blocks:
+                    blocks = blocks if len(blocks) > len(type_blocks[res_idx]) else type_blocks[res_idx]
+                self.blocks[resource_type][res_idx] = blocks
 
-                    elif data_type == 'descriptor':  # this could change later
-                        if tattr_idx not in self.constants:
-                            self.constants[tattr_idx] = {}
-                        self.constants[tattr_idx][res_idx] = value
-
-                    elif data_type == 'timeseries':
-                        values = value
-                        function = None
-
-                        try:
-                            if is_function:
-                                function = metadata['function']
-                                if not function:  # if there is no function, this will be treated as no dataset
-                                    continue
-
-                            # routine to add blocks using quadratic values - this needs to be paired with a similar routine when updating boundary conditions
-                            # if has_blocks:
-                            #     values = add_subblocks(values, attr_name, self.default_subblocks)
-
-                            if tattr_idx not in self.variables:
-                                self.variables[tattr_idx] = {}
-
-                            self.variables[tattr_idx][res_idx] = {
-                                'data_type': data_type,
-                                'values': values,
-                                'is_function': is_function,
-                                'function': function,
-                                'has_blocks': has_blocks,
-                            }
-                        except:
-                            raise
-
-                    self.store[parentkey] = value
-
-                    # update resource blocks to match max of this type block and previous type blocks
-                    type_blocks = self.blocks[resource_type]
-                    if res_idx in type_blocks:
-                        blocks = blocks if len(blocks) > len(type_blocks[res_idx]) else type_blocks[res_idx]
-                    self.blocks[resource_type][res_idx] = blocks
-
-                except Exception as err:
-                    if resource_type == 'network':
-                        resource_name = 'network'
-                    else:
-                        resource_name = self.resources.get((resource_type, resource_id), {}).get('name',
-                                                                                                 'unknown resource')
+            except Exception as err:
+                if resource_type == 'network':
+                    resource_name = 'network'
+                else:
+                    resource_name = self.resources.get((resource_type, resource_id), {}).get('name',
+                                                                                             'unknown resource')
 
-                    msg = '{}\n\n{}'.format(
-                        err,
-                        'This error occurred when calculating {} for {}.'.format(rs['value']['name'], resource_name)
-                    )
+                msg = '{}\n\n{}'.format(
+                    err,
+                    'This error occurred when calculating {} for {}.'.format(rs['value']['name'], resource_name)
+                )
 
-                    raise Exception(msg)
+                raise Exception(msg)
 
     def initialize(self, supersubscenario):
         """A wrapper for all initialization steps."""
@@ -460,14 +440,54 @@ class WaterSystem(object):
         # set up subscenario
         self.setup_subscenario(supersubscenario)
 
-        current_dates = self.dates[:self.foresight_periods]
+        self.build_model()
+
+    def reinitialize(self, supersubscenario):
+        """
+        Set up another subscenario after a run, reusing the model already built if possible.
+
+        The model is only rebuilt if this subscenario's variations add constants or variables (ones that exist only
+        because of a variation) that differ from the last subscenario's, since a reused model would otherwise keep
+        values set by the last subscenario.
+        """
+
+        signature = self.overlay_signature()
+
+        self.store = {}
+        self.evaluator.store = self.store
+
+        self.setup_subscenario(supersubscenario)
+
+        if getattr(self, 'model', None) is None or self.overlay_signature() != signature:
+            self.build_model()
+        else:
+            start, end, step = self.initial_timesteps()
+            self.model.setup(start=start, end=end, step=step)  # this also resets the model
+            self.bind_results()
+
+    def overlay_signature(self):
+        overlay = self.overlay
+        return sorted((tattr_idx, res_idx) for items in [overlay.constants, overlay.variables]
+                      for tattr_idx, values in items.items() for res_idx in values)
+
+    def initial_timesteps(self):
         current_dates_as_string = self.dates_as_string[:self.foresight_periods]
-        step = self.dates[0].day
+        return current_dates_as_string[0], current_dates_as_string[-1], self.dates[0].day
+
+    def model_key(self, initial_volumes):
+        """
+        What a built model depends on, for reusing it in later tasks (None if the network's revision is unknown).
+        """
+        token = revision_token(self.network, self.scenario.scenario_ids, self.template)
+        if token is None:
+            return None
+        return (token, self.template.id, tuple(self.scenario.scenario_ids), tuple(self.overlay_signature()),
+                tuple(sorted(initial_volumes.items())))
+
+    def build_model(self):
 
         # set up the time steps
-        start = current_dates_as_string[0]
-        end = current_dates_as_string[-1]
-        step = step
+        start, end, step = self.initial_timesteps()
 
         # set up the initial volumes
         initial_volumes = {}
@@ -477,14 +497,29 @@ class WaterSystem(object):
             for resource_id, value in values.items():
                 initial_volumes[resource_id] = convert(value * scale, 'Volume', unit, 'hm^3')
 
-        self.model = PywrModel(
-            network=self.network,
-            template=self.template,
-            start=start,
-            end=end,
-            step=step,
-            initial_volumes=initial_volumes
-        )
+        # reuse a model built by an earlier task in this process, if there is one for the same inputs
+        key = self.model_key(initial_volumes)
+        model = models.get(key)
+        if model is not None:
+            model.setup(start=start, end=end, step=step)  # this also resets the model
+            self.model = model
+        else:
+            from waterlp.models.pywr import PywrModel  # Pywr is only needed where models are run
+
+            memory_before = current_memory_mb()
+            self.model = PywrModel(
+                network=self.network,
+                template=self.template,
+                start=start,
+                end=end,
+                step=step,
+                initial_volumes=initial_volumes
+            )
+            memory_after = current_memory_mb()
+            models.put(key, self.model, memory_after - memory_before if memory_before is not None else None)
+
+        # bind model outputs to the result table
+        self.bind_results()
 
     def prepare_params(self):
         """
@@ -518,12 +553,34 @@ class WaterSystem(object):
                         resource_type=resource_type.lower()
                     )
                     del param['properties']
+
+                    # resolve unit conversions to and from the model once, rather than for every value
+                    param.update(
+                        model_factor=self.get_model_factor(param.dimension, param.unit, param.scale),
+                        result_factor=self.get_model_factor(param.dimension, param.unit, param.scale, reverse=True)
+                    )
                     self.params[tattr_idx] = param
 
                     if tattr['attr_name'] == 'Initial Storage':
                         self.storage_scale = param.get('scale', 1)
                         self.storage_unit = param.unit
 
+    @staticmethod
+    def get_model_factor(dimension, unit, scale, reverse=False):
+        """
+        Get the factor converting a scaled value in the given unit to the model unit (or back, if reverse).
+        Values of dimensions the model doesn't convert are left as is (factor 1). None means the unit is unknown.
+        """
+        model_unit = MODEL_UNITS.get(dimension)
+        if not model_unit:
+            return 1
+        conversion = conversion_factor(dimension, model_unit, unit) if reverse else conversion_factor(
+            dimension, unit, model_unit)
+        if conversion is None:
+            return None
+        factor, offset = conversion
+        return factor / scale if reverse else factor * scale
+
     def setup_subscenario(self, supersubscenario):
         """
         Add variation to all resource attributes as needed.
@@ -549,7 +606,10 @@ class WaterSystem(object):
                 'variations': vs
             }
 
-        for variation_set in variation_sets:
+        # variations go in an overlay, as the base constants and variables are shared with other subscenarios
+        self.overlay = overlay = VariationOverlay()
+        for i, variation_set in enumerate(variation_sets):
+            t0 = time.time()
             for key, variation in variation_set['variations'].items():
                 (resource_type, resource_id, attr_id) = key
                 tattr = self.conn.tattrs[key]
@@ -563,32 +623,57 @@ class WaterSystem(object):
                 # at this point, timeseries have not been assigned to variables, so these are mutually exclusive
                 # the order here shouldn't matter
                 variable = self.constants.get(tattr_idx, {}).get(idx)
-                timeseries = self.variables.get(tattr_idx, {}).get(idx)
-                if variable:
-                    self.constants[tattr_idx][idx] = perturb(self.constants[tattr_idx][idx], variation)
+                timeseries = self.variables.get(tattr_idx, {}).get(idx) or overlay.variables.get(tattr_idx, {}).get(idx)
+                if idx in overlay.constants.get(tattr_idx, {}):
+                    overlay.constants[tattr_idx][idx] = perturb(overlay.constants[tattr_idx][idx], variation)
+
+                elif variable:
+                    overlay.add(tattr_idx, idx, variation)
 
                 elif timeseries:
                     if not timeseries.get('function'):  # functions will be handled by the evaluator
-                        self.variables[tattr_idx][idx]['values'] = perturb(self.variables[tattr_idx][idx]['values'],
-                                                                           variation)
+                        overlay.vary_values(tattr_idx, idx, timeseries['values'], variation, self.dates_as_string)
 
                 else:  # we need to add the variable to account for the variation
                     data_type = tattr['data_type']
                     if data_type == 'scalar':
-                        if tattr_idx not in self.constants:
-                            self.constants[tattr_idx] = {}
-                        self.constants[tattr_idx][idx] = perturb(0, variation)
+                        overlay.constants.setdefault(tattr_idx, {})[idx] = perturb(0, variation)
                     elif data_type == 'timeseries':
-
-                        if tattr_idx not in self.constants:
-                            self.constants[tattr_idx] = {}
-                        self.variables[tattr_idx][idx] = {
-                            'values': perturb(self.evaluator.default_timeseries.copy(), variation),
+                        values = numpy.zeros(len(self.dates_as_string))
+                        overlay.variables.setdefault(tattr_idx, {})[idx] = {
+                            'values': values,
                             'dimension': tattr['dimension']
                         }
+                        overlay.vary_values(tattr_idx, idx, values, variation, self.dates_as_string)
+
+            overlay.timings.append(time.time() - t0)
+            if self.args.debug:
+                print('Applied {} variations of variation set {} in {:.4f} s'.format(
+                    len(variation_set['variations']), i + 1, overlay.timings[-1]))
+
+    def get_constant(self, tattr_idx, res_idx, default=None):
+        """Get a constant, with any subscenario variation applied"""
+        value = self.overlay.constants.get(tattr_idx, {}).get(res_idx)
+        if value is not None:
+            return value
+        value = self.constants.get(tattr_idx, {}).get(res_idx)
+        if value is None:
+            return default
+        return self.overlay.apply(value, tattr_idx, res_idx)
+
+    def iter_variables(self):
+        """
+        Iterate over (tattr_idx, res_idx, variable, values), including variables added by subscenario variations.
+        The values are those of the variable, with any subscenario variations applied.
+        """
+        overlay = self.overlay
+        for variables in (self.variables, overlay.variables):
+            for tattr_idx, params in variables.items():
+                for res_idx, param in params.items():
+                    yield tattr_idx, res_idx, param, overlay.get_values(tattr_idx, res_idx, param.get('values'))
 
     def update_boundary_condition(self, res_idx, tattr_idx, dates_as_string, is_function=False, func=None, values=None,
-                                  step='main', scope='store'):
+                                  step='main', scope='store', tsi=0):
 
         try:
             resource_type, type_name, attr_id = tattr_idx
@@ -605,9 +690,7 @@ class WaterSystem(object):
             if param.is_var == 'Y' and step != 'post-process':
                 return
 
-            dimension = param.dimension
             data_type = param.data_type
-            unit = param.unit
             startup_date = self.constants.get('Startup Date', '')
 
             # for updating Pywr
@@ -615,6 +698,7 @@ class WaterSystem(object):
             attr_name_lower = param['attr_name'].lower()
 
             parentkey = '{}/{}/{}'.format(resource_type, resource_id, attr_id)
+            model_factor = param.model_factor
 
             if is_function:
                 if scope == 'store':
@@ -640,13 +724,18 @@ class WaterSystem(object):
                 # if has_blocks:
                 #     values = add_subblocks(values, attr_name, self.default_subblocks)
 
-            if param.has_blocks:
+            # timeseries data is held as arrays aligned to the run dates; function results are dictionaries
+            is_array = type(values) == numpy.ndarray
+
+            if param.has_blocks and not is_array:
                 cols = values.keys()
             else:
                 cols = [0]
             for j, c in enumerate(cols):
 
-                if param.has_blocks:
+                if is_array:
+                    vals = values
+                elif param.has_blocks:
                     vals = values[c]
                 else:
                     vals = values.get(c, values)
@@ -654,7 +743,13 @@ class WaterSystem(object):
                 # update values variable
                 for i, datetime in enumerate(dates_as_string):
 
-                    if datetime not in vals:
+                    if is_array:
+                        val = vals[tsi + i]
+                        if val != val:
+                            continue  # missing
+                    elif datetime in vals:
+                        val = vals[datetime]
+                    else:
                         continue
 
                     # set value of anything with a start date to zero
@@ -663,9 +758,6 @@ class WaterSystem(object):
                     if datetime < startup_date:
                         val = 0
 
-                    else:
-                        val = vals[datetime]
-
                     if scope == 'store':
                         # send the result to the data store
                         self.store_value(resource_type, resource_id, attr_id, datetime, val,
@@ -675,13 +767,9 @@ class WaterSystem(object):
                     # if step != 'main':
                     #     continue
 
+                    # only convert if updating the LP model
                     if val is not None:
-                        scale = param.scale
-                        # only convert if updating the LP model
-                        if dimension == 'Volumetric flow rate':
-                            val = convert(val * scale, dimension, unit, 'hm^3 day^-1')
-                        elif dimension == 'Volume':
-                            val = convert(val * scale, dimension, unit, 'hm^3')
+                        val = val * model_factor if model_factor is not None else None
 
                     try:
                         self.model.update_param(resource_type, resource_id, type_name_lower, attr_name_lower, val)
@@ -712,105 +800,91 @@ class WaterSystem(object):
         self.evaluator.tsf = tsf
 
         # 1. Update values in memory store
-        for tattr_idx, params in self.variables.items():
-            for res_idx, param in params.items():
+        for tattr_idx, res_idx, param, values in self.iter_variables():
+            self.update_boundary_condition(
+                res_idx,
+                tattr_idx,
+                dates_as_string,
+                values=values,
+                is_function=param.get('is_function'),
+                func=param.get('function'),
+                step=step,
+                scope='store',
+                tsi=tsi
+            )
+
+        # 2. update Pyomo model
+        if step == 'main':
+            # for attr_name in self.valueParams + self.demandParams:
+            self.model.updated = {}
+            for tattr_idx, res_idx, param, values in self.iter_variables():
                 self.update_boundary_condition(
                     res_idx,
                     tattr_idx,
                     dates_as_string,
-                    values=param.get('values'),
+                    values=values,
                     is_function=param.get('is_function'),
                     func=param.get('function'),
                     step=step,
-                    scope='store'
+                    scope='model',
+                    tsi=tsi
                 )
 
-        # 2. update Pyomo model
-        if step == 'main':
-            # for attr_name in self.valueParams + self.demandParams:
-            self.model.updated = {}
-            for tattr_idx, params in self.variables.items():
-                for res_idx, param in params.items():
-                    self.update_boundary_condition(
-                        res_idx,
-                        tattr_idx,
-                        dates_as_string,
-                        values=param.get('values'),
-                        is_function=param.get('is_function'),
-                        func=param.get('function'),
-                        step=step,
-                        scope='model'
-                    )
+    def bind_results(self):
+        """
+        Bind each model output to a row of a preallocated result table.
+        This resolves everything about an output (its attribute, parameter and unit conversion) once, up front.
+        """
 
-    def collect_results(self, timesteps, tsidx, include_all=False, suppress_input=False):
+        self.results = results = ResultTable(len(self.dates), flush_every=self.args.flush_every,
+                                             spill_dir=self.args.spill_dir)
 
-        # loop through all the model parameters and variables
+        outputs = []
         for (resource_type, resource_id), node in self.model.non_storage.items():
-            self.store_results(
-                resource_type=resource_type,
-                resource_id=resource_id,
-                attr_name='inflow',
-                timestamp=timesteps[0],
-                value=node.flow[0],
-            )
-
-            self.store_results(
-                resource_type=resource_type,
-                resource_id=resource_id,
-                attr_name='outflow',
-                timestamp=timesteps[0],
-                value=node.flow[0],
-            )
-
+            outputs.append((resource_type, resource_id, 'inflow', node, FLOW))
+            outputs.append((resource_type, resource_id, 'outflow', node, FLOW))
         for resource_id, node in self.model.storage.items():
-            self.store_results(
-                resource_type='node',
-                resource_id=resource_id,
-                attr_name='storage',
-                timestamp=timesteps[0],
-                value=node.volume[0],
-            )
-            self.store_results(
-                resource_type='node',
-                resource_id=resource_id,
-                attr_name='outflow',
-                timestamp=timesteps[0],
-                value=sum([input.flow[0] for input in node.inputs]),  # "input" means "input to the system"
-            )
-            self.store_results(
-                resource_type='node',
-                resource_id=resource_id,
-                attr_name='inflow',
-                timestamp=timesteps[0],
-                value=sum([output.flow[0] for output in node.outputs]),
-            )
-
-    def store_results(self, resource_type=None, resource_id=None, attr_name=None, timestamp=None, value=None):
-
-        type_name = self.resources[(resource_type, resource_id)]['type']['name']
-        attr_id = self.conn.attr_id_lookup.get((resource_type, resource_id, attr_name))
-        if not attr_id:
-            return  # this is not an actual attribute in the model
-        tattr_idx = (resource_type, type_name, attr_id)
-        param = self.params.get(tattr_idx, {})
-
-        has_blocks = param.has_blocks
-        dimension = param.dimension
-        unit = param.unit
-        scale = param.scale
+            outputs.append(('node', resource_id, 'storage', node, VOLUME))
+            outputs.append(('node', resource_id, 'outflow', node, STORAGE_OUTFLOW))
+            outputs.append(('node', resource_id, 'inflow', node, STORAGE_INFLOW))
+
+        for resource_type, resource_id, attr_name, node, kind in outputs:
+            attr_id = self.conn.attr_id_lookup.get((resource_type, resource_id, attr_name))
+            if not attr_id:
+                continue  # this is not an actual attribute in the model
+            key = (resource_type, resource_id, attr_id)
+            tattr = self.conn.tattrs.get(key)
+            if not tattr:
+                continue
+            type_name = self.resources[(resource_type, resource_id)]['type']['name']
+            param = self.params.get((resource_type, type_name, attr_id))
+            if not param:
+                continue
+
+            # register the output with the evaluator, so functions can get it
+            if key not in self.evaluator.rs_values:
+                self.evaluator.rs_values[key] = {
+                    'type': tattr['data_type'],
+                    'unit': tattr['unit'],
+                    'dimension': tattr['dimension'],
+                    'value': None
+                }
 
-        # collect to results
+            key_string = '{}/{}/{}'.format(resource_type, resource_id, attr_id)
+            results.bind(key_string, node, kind, param.result_factor, has_blocks=param.has_blocks)
 
-        # the purpose of this addition is to aggregate blocks, if any, thus eliminating the need for Pandas
-        # on the other hand, it should be checked which is faster: Pandas group_by or simple addition here
+        # with flushing, stored input values are spilled with the model results, rather than kept in the store
+        if results.window < results.ndates:
+            for tattr_idx, res_idx, param, values in self.iter_variables():
+                if not param.has_blocks:
+                    results.bind_stored('{}/{}/{}'.format(res_idx[0], res_idx[1], tattr_idx[2]))
+            results.bind_store(self.store, self.dates_as_string)
 
-        if dimension == 'Volume':
-            value = convert(value, dimension, 'hm^3', unit) / scale
-        elif dimension == 'Volumetric flow rate':
-            value = convert(value, dimension, 'hm^3 day^-1', unit) / scale
+        results.allocate()
+        self.evaluator.results = results
 
-        # store in evaluator store
-        self.store_value(resource_type, resource_id, attr_id, timestamp, value, has_blocks=has_blocks)
+    def collect_results(self, timesteps, tsidx, include_all=False, suppress_input=False):
+        self.results.collect(tsidx)
 
     def get_value(self, resource_type, resource_id, attr_id, timestamp=None, has_blocks=False):
 
@@ -873,6 +947,8 @@ class WaterSystem(object):
                 return None
 
     def save_to_file(self, filename, content):
+        import boto3
+
         s3 = boto3.client('s3')
         key = '{network_folder}/{log_dir}/{filename}'.format(
             network_folder=self.storage.folder,
@@ -886,12 +962,37 @@ class WaterSystem(object):
         if self.scenario.reporter:
             self.scenario.reporter.report(action='save', saved=0)
 
-        if self.args.destination == 'source':
-            self.save_results_to_source()
-        elif self.args.destination == 'local':
-            self.save_results_to_local()
-        elif self.args.destination == 'aws_s3':
-            self.save_results_to_s3()
+        # model results are read from the result table (and its spill file, if any) as they are saved
+        if self.results is not None:
+            self.results.flush()
+
+        try:
+            if self.args.destination == 'source':
+                self.save_results_to_source()
+            elif self.args.destination == 'local':
+                self.save_results_to_local()
+            elif self.args.destination == 'aws_s3':
+                self.save_results_to_s3()
+        finally:
+            if self.results is not None:
+                self.results.close()
+
+        if self.args.debug:
+            print('Peak memory: {:.0f} MB'.format(peak_memory_mb() or 0))
+            print('Model cache: {hits} hits, {misses} misses; {entries} models ({size_mb} MB)'.format(**models.stats()))
+            self.conn.print_metrics()
+
+    def iter_results(self):
+        """
+        Stored values and bound model results to save, as (key, stored value) pairs.
+        Model results are not copied to the store, so their stored value is None.
+        """
+        for key, value in self.store.items():
+            yield key, value
+        if self.results is not None:
+            for key in self.results.output_keys:
+                if key not in self.store:
+                    yield key, None
 
     def save_results_to_source(self):
 
@@ -931,14 +1032,21 @@ class WaterSystem(object):
         self.scenario.scenario_id = result_scenario['id']
 
         # save variable data to database
-        res_scens = []
-        mb = 0
-        res_names = {}
+        n = 0
+        N = len(self.store)
+        if self.results is not None:
+            N += len([key for key in self.results.output_keys if key not in self.store])
+
+        def report_progress(saved):
+            if self.scenario.reporter:
+                self.scenario.reporter.report(action='save', saved=round(saved / N * 100))
+
+        uploader = ResultUploader(self.conn, result_scenario, max_workers=self.args.upload_workers,
+                                  on_progress=report_progress, debug=self.args.debug)
 
         try:
-            n = 0
-            N = len(self.store)
-            for key, value in self.store.items():
+            results = self.results
+            for key, value in self.iter_results():
                 n += 1
                 resource_type, resource_id, attr_id = key.split('/')
                 resource_id = int(resource_id)
@@ -962,12 +1070,16 @@ class WaterSystem(object):
                 resource_name = self.conn.raid_to_res_name[res_attr_id]
                 attr_name = tattr['attr_name']
 
-                # define the dataset value
+                if tattr['dimension'] == 'Temperature':
+                    continue  # TODO: fix this!!!
+
+                # define the dataset value, straight from the result array if it's a model result
                 try:
-                    if param.has_blocks and type(list(value.values())[0]) == dict:
-                        value = pd.DataFrame(value).to_json()
+                    row = results.rows.get(key) if results is not None else None
+                    if row is not None:
+                        value = serialize_array(self.dates_as_string[:results.written], results.row_values(row))
                     else:
-                        value = pd.DataFrame({0: value}).to_json()
+                        value = serialize_series(value, has_blocks=param.has_blocks)
                 except:
                     print('Failed to prepare: {}'.format(attr_name))
                     continue
@@ -983,9 +1095,6 @@ class WaterSystem(object):
                                                                attr_name,
                                                                self.scenario.name)
 
-                if tattr['dimension'] == 'Temperature':
-                    continue  # TODO: fix this!!!
-
                 rs = {
                     'resource_attr_id': res_attr_id,
                     'value': {
@@ -996,27 +1105,10 @@ class WaterSystem(object):
                         'value': value
                     }
                 }
-                res_scens.append(rs)
-                mb += len(value.encode()) * 1.1 / 1e6  # large factor of safety
-
-                if mb > 10 or n % 100 == 0:
-                    result_scenario['resourcescenarios'] = res_scens[:-1]
-                    resp = self.conn.dump_results(result_scenario)
-                    if 'id' not in resp:
-                        raise Exception('Error saving data')
-                    if self.scenario.reporter:
-                        self.scenario.reporter.report(
-                            action='save',
-                            saved=round(n / N * 100)
-                        )
-
-                    # purge just-uploaded scenarios
-                    res_scens = res_scens[-1:]
-                    mb = 0
+                uploader.add(rs, len(value) * 1.1 / 1e6)  # large factor of safety
 
             # upload the last remaining resource scenarios
-            result_scenario['resourcescenarios'] = res_scens
-            resp = self.conn.dump_results(result_scenario)
+            uploader.close()
 
             self.scenario.result_scenario_id = result_scenario['id']
 
@@ -1028,136 +1120,130 @@ class WaterSystem(object):
                                                   message="ERROR: No results have been reported. The model might not have run.")
 
         except:
+            uploader.abort()
             msg = 'ERROR: Results could not be saved.'
             # self.logd.info(msg)
             if self.scenario.reporter:
                 self.scenario.reporter.report(action='error', message=msg)
             raise
 
-    # def save_results_to_s3(self):
-    #
-    #     import boto3
-    #     s3 = boto3.client('s3')
-    #
-    #     if len(self.scenario.base_ids) == 1:
-    #         o = s = self.scenario.base_ids[0]
-    #     else:
-    #         o, s = self.scenario.base_ids
-    #     base_path = 'results/P{project}/N{network}/{scenario}/{run}/V{subscenario:05}'.format(
-    #         project=self.network.project_id,
-    #         network=self.network.id,
-    #         run=self.args.start_time,
-    #         scenario='O{}-S{}'.format(o, s),
-    #         subscenario=self.metadata['number'])
-    #
-    #     # save variable data to database
-    #     res_scens = []
-    #     res_names = {}
-    #
-    #     try:
-    #
-    #         # write metadata
-    #         content = json.dumps(self.metadata, sort_keys=True, indent=4, separators=(',', ': ')).encode()
-    #         s3.put_object(Body=content, Bucket='openagua.org', Key=base_path + '/metadata.json')
-    #
-    #         count = 1
-    #         pcount = 1
-    #         nparams = len(self.store)
-    #         path = base_path + '/data/{parameter}.csv'
-    #         for attr_name, param_values in self.store.items():
-    #             pcount += 1
-    #             df = self.param_to_df(attr_name, param_values)
-    #             content = df.to_csv().encode()
-    #
-    #             if content:
-    #                 s3.put_object(Body=content, Bucket='openagua.org', Key=path.format(parameter=attr_name))
-    #
-    #             if count % 10 == 0 or pcount == nparams:
-    #                 if self.scenario.reporter:
-    #                     self.scenario.reporter.report(action='save', saved=round(count / (self.nparams + self.nvars) * 100))
-    #             count += 1
-    #
-    #     except:
-    #         msg = 'ERROR: Results could not be saved.'
-    #         # self.logd.info(msg)
-    #         if self.scenario.reporter:
-    #             self.scenario.reporter.report(action='error', message=msg)
-    #         raise
-    #
-    def save_results_to_local(self):
+    def results_path(self):
+        """The location of this subscenario's results, relative to the results root"""
 
         if len(self.scenario.base_ids) == 1:
             o = s = self.scenario.base_ids[0]
         else:
             o, s = self.scenario.base_ids
-        base_path = './results/P{project}/N{network}/{scenario}/{run}/V{subscenario:05}'.format(
+        return 'results/P{project}/N{network}/{scenario}/{run}/V{subscenario:05}'.format(
             project=self.network.project_id,
             network=self.network.id,
             run=self.args.start_time,
             scenario='O{}-S{}'.format(o, s),
             subscenario=self.metadata['number'])
 
-        if not os.path.exists(base_path):
-            os.makedirs(base_path)
+    def group_results(self):
+        """Results grouped by resource type and attribute, as the run dates and a lookup for write_results"""
 
         res_names = {
             'node': {n.id: n.name for n in self.network.nodes},
             'link': {l.id: l.name for l in self.network.links}
         }
 
-        try:
+        results = self.results
+        dates = self.dates_as_string[:results.written] if results is not None else self.dates_as_string
 
-            # write metadata
-            with open('{}/metadata.json'.format(base_path), 'w') as f:
-                json.dump(self.metadata, f, sort_keys=True, indent=4, separators=(',', ': '))
+        # group results by resource type and attribute, one row per resource
+        groups = {}
+        for key, values in self.iter_results():
 
-            count = 1
-            pcount = 1
-            nparams = len(self.store)
-            path = base_path + '/data/{parameter}.csv'
-            results = {}
-            for key, values in self.store.items():
-                pcount += 1
+            resource_type, resource_id, attr_id = key.split('/')
+            resource_id = int(resource_id)
+            attr_id = int(attr_id)
 
-                resource_type, resource_id, attr_id = key.split('/')
-                resource_id = int(resource_id)
-                attr_id = int(attr_id)
+            tattr = self.conn.tattrs.get((resource_type, resource_id, attr_id))
+            if not tattr:
+                # Same as previous issue.
+                # This is because the model assigns all resource attribute possibilities to all resources of like type
+                # In practice this shouldn't make a difference, but may result in a model larger than desired
+                # TODO: correct this
+                continue
 
-                tattr = self.conn.tattrs.get((resource_type, resource_id, attr_id))
-                if not tattr:
-                    # Same as previous issue.
-                    # This is because the model assigns all resource attribute possibilities to all resources of like type
-                    # In practice this shouldn't make a difference, but may result in a model larger than desired
-                    # TODO: correct this
-                    continue
+            type_name = self.resources[(resource_type, resource_id)]['type']['name']
+            tattr_idx = (resource_type, type_name, attr_id)
 
-                type_name = self.resources[(resource_type, resource_id)]['type']['name']
-                attr_name = tattr['attr_name']
-                tattr_idx = (resource_type, type_name, attr_name)
+            if tattr_idx not in self.params:
+                continue  # it's probably an internal variable/parameter
 
-                if tattr_idx not in self.params:
-                    continue  # it's probably an internal variable/parameter
+            res_name = res_names.get(resource_type, {}).get(resource_id) or self.network.name
+            try:
+                row = results.rows.get(key) if results is not None else None
+                if row is not None:
+                    data = partial(results.row_values, row)  # read as the file is written
+                else:
+                    data = values_to_array(values, dates)
+            except:
+                continue
+
+            group = groups.get((resource_type, attr_id))
+            if group is None:
+                group = groups[(resource_type, attr_id)] = {
+                    'attr_name': tattr['attr_name'],
+                    'unit': tattr['unit'],
+                    'dimension': tattr['dimension'],
+                    'rows': []
+                }
+            group['rows'].append((resource_id, res_name, data))
 
-                res_name = res_names.get(resource_type, {}).get(resource_id) or self.network.name
-                try:
-                    data = pd.DataFrame.from_dict(values, orient='index', columns=[res_name])
-                    if tattr_idx not in results:
-                        results[tattr_idx] = data
-                    else:
-                        results[tattr_idx] = pd.concat([results[tattr_idx], data], axis=1, sort=True)
-                except:
-                    continue
+        return dates, groups
+
+    def write_results_file(self, path):
+
+        dates, groups = self.group_results()
+        ngroups = len(groups)
+
+        def report_progress(count):
+            if self.scenario.reporter and (count % 10 == 0 or count == ngroups):
+                self.scenario.reporter.report(action='save', saved=round(count / ngroups * 100))
+
+        write_results(path, dates, groups, metadata=self.metadata, on_progress=report_progress)
+
+    def save_results_to_s3(self):
+
+        backend = get_backend(self.args)
+        base_path = self.results_path()
+
+        try:
+            fd, path = tempfile.mkstemp(suffix='.h5')
+            os.close(fd)
+            try:
+                self.write_results_file(path)
+
+                # write metadata
+                content = json.dumps(self.metadata, sort_keys=True, indent=4, separators=(',', ': ')).encode()
+                backend.put(base_path + '/metadata.json', content)
+
+                nparts = upload_file(backend, base_path + '/' + RESULTS_FILE, path,
+                                     max_workers=self.args.upload_workers)
+                if self.args.debug:
+                    print('Uploaded results to {} in {} part(s)'.format(base_path, nparts))
+            finally:
+                os.remove(path)
 
-            for (resource_type, type_name, attr_name), data in results.items():
+        except:
+            msg = 'ERROR: Results could not be saved.'
+            # self.logd.info(msg)
+            if self.scenario.reporter:
+                self.scenario.reporter.report(action='error', message=msg)
+            raise
 
-                if not data.empty:
-                    data.to_csv('{}/{}.csv'.format(base_path, attr_name))
+    def save_results_to_local(self):
 
-                if count % 10 == 0 or pcount == nparams:
-                    if self.scenario.reporter:
-                        self.scenario.reporter.report(action='save',
-                                                      saved=round(count / (self.nparams + self.nvars) * 100))
-                count += 1
+        base_path = os.path.join('.', self.results_path())
+        if not os.path.exists(base_path):
+            os.makedirs(base_path)
+
+        try:
+            self.write_results_file(os.path.join(base_path, RESULTS_FILE))
 
         except:
             msg = 'ERROR: Results could not be saved.'
@@ -0,0 +1,92 @@
+import operator
+from bisect import bisect_left, bisect_right
+
+import numpy
+
+# these work on scalars and, element-wise, on whole numpy arrays
+OPERATORS = {
+    'multiply': operator.mul,
+    'divide': operator.truediv,
+    'add': operator.add,
+    'subtract': operator.sub,
+}
+
+
+def perturb(val, variation):
+    # NB: this is made explicit to avoid using exec
+    op = OPERATORS.get(variation['operator'])
+    if val is None or op is None:
+        return val
+    return op(val, variation['value'])
+
+
+def variation_mask(variation, dates_as_string=None, ndim=1):
+    """
+    Get the array index a variation applies to.
+
+    A variation may be limited to a date range with 'start' and/or 'end' (inclusive, as date strings comparable
+    with dates_as_string; an end date without a time includes that whole day), and to blocks with 'blocks' (a list of block indices, for 2-d arrays).
+    """
+    start = variation.get('start')
+    end = variation.get('end')
+    if dates_as_string and (start or end):
+        i0 = bisect_left(dates_as_string, start) if start else 0
+        i1 = bisect_right(dates_as_string, end + '~') if end else len(dates_as_string)  # a date includes its day
+        rows = slice(i0, i1)
+    else:
+        rows = slice(None)
+
+    blocks = variation.get('blocks')
+    if ndim == 2 and blocks is not None:
+        return rows, list(blocks)
+    return rows
+
+
+def apply_variation(values, variation, dates_as_string=None):
+    """
+    Apply a variation to a whole timeseries array at once.
+    A new array is returned, so the values passed in, which may be shared, are left as is.
+    """
+    op = OPERATORS.get(variation['operator'])
+    result = numpy.array(values, dtype=float)
+    if op is None:
+        return result
+    idx = variation_mask(variation, dates_as_string, ndim=result.ndim)
+    result[idx] = op(result[idx], variation['value'])
+    return result
+
+
+class VariationOverlay(object):
+    """
+    Subscenario variations layered over the system's base constants and variables.
+
+    The base data is shared, read-only, by all subscenarios prepared from the same system, so variations are never
+    applied to it directly. Instead, each subscenario keeps its own overlay. Constants are varied when read;
+    timeseries are varied once, as whole arrays, into the overlay's own copies.
+    """
+
+    def __init__(self):
+        self.deltas = {}  # (tattr_idx, res_idx) -> variations, in the order they are applied
+        self.values = {}  # (tattr_idx, res_idx) -> varied timeseries array
+        self.constants = {}  # constants that exist only to account for a variation, as tattr_idx -> res_idx -> value
+        self.variables = {}  # likewise for variables
+        self.timings = []  # seconds taken to apply each variation set
+
+    def add(self, tattr_idx, res_idx, variation):
+        self.deltas.setdefault((tattr_idx, res_idx), []).append(variation)
+
+    def get(self, tattr_idx, res_idx):
+        return self.deltas.get((tattr_idx, res_idx))
+
+    def apply(self, val, tattr_idx, res_idx):
+        for variation in self.deltas.get((tattr_idx, res_idx), ()):
+            val = perturb(val, variation)
+        return val
+
+    def vary_values(self, tattr_idx, res_idx, values, variation, dates_as_string=None):
+        key = (tattr_idx, res_idx)
+        self.values[key] = apply_variation(self.values.get(key, values), variation, dates_as_string)
+        self.add(tattr_idx, res_idx, variation)
+
+    def get_values(self, tattr_idx, res_idx, default=None):
+        return self.values.get((tattr_idx, res_idx), default)
@@ -64,9 +64,42 @@ def commandline_parser():
     parser.add_argument('--c', dest='custom', type=dict, default={},
                         help='''Custom arguments passed as stringified JSON.''')
     parser.add_argument('--dest', dest='destination', default='source',
-                        help='''Destination of results. Options for now include "source" or "aws_s3"''')
+                        help='''Destination of results. Options for now include "source", "local" (an HDF5 file per
+                        subscenario) or "aws_s3"''')
+    parser.add_argument('--flush', dest='flush_every', type=int, default=None,
+                        help='''Keep at most this many time steps of model results in memory, spilling older results
+                        to a local file. This bounds memory use for long runs.''')
+    parser.add_argument('--spill_dir', dest='spill_dir', default=None,
+                        help='''The directory for result spill files (defaults to the system temp directory).''')
+    parser.add_argument('--local', dest='local_workers', type=int, default=None,
+                        help='''Run all subscenarios in a pool of up to this many local processes, instead of sending
+                        them to Celery workers.''')
+    parser.add_argument('--chunk', dest='chunk_target', type=float, default=None,
+                        help='''Run several subscenarios per task, so that each task takes about this many seconds,
+                        based on past runtimes of the network.''')
+    parser.add_argument('--artifact_dir', dest='artifact_dir', default=None,
+                        help='''A directory shared by all workers for prepared systems sent to scenario runs. If not
+                        given, prepared systems are shared through Redis.''')
+    parser.add_argument('--bucket', dest='aws_s3_bucket', default=environ.get('AWS_S3_BUCKET'),
+                        help='''The S3 bucket for files and results (for the "aws_s3" destination).''')
+    parser.add_argument('--store_dir', dest='store_dir',
+                        help='''A local directory to use in place of the S3 bucket for the "aws_s3" destination.''')
     parser.add_argument('--si', dest='suppress_input', action='store_true',
                         help='''Suppress input from results. This can speed up writing results.''')
+    parser.add_argument('--parse', dest='parse_mode', default='serial',
+                        help='''How to parse source datasets before the run: "serial", "thread" or "process".''')
+    parser.add_argument('--parse_workers', dest='parse_workers', type=int, default=None,
+                        help='''The number of workers for parsing source datasets (defaults to the number of CPUs).''')
+    parser.add_argument('--no_cache', dest='use_cache', action='store_false',
+                        help='''Don't use cached copies of the network and template, even if they are unchanged.''')
+    parser.add_argument('--retries', dest='max_retries', type=int, default=3,
+                        help='''The number of times to retry a call to the data server if it fails to connect or the
+                        server is unavailable.''')
+    parser.add_argument('--batch', dest='batch_calls', action='store_true',
+                        help='''Make several data server calls in one request, where possible. The data server must
+                        accept a JSON list of calls.''')
+    parser.add_argument('--upload_workers', dest='upload_workers', type=int, default=4,
+                        help='''The number of result chunks to upload to the data server at once.''')
     parser.add_argument('--st', dest='start_time', default=datetime.now().isoformat(), help='''Run start time.''')
 
     return parser
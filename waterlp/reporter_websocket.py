@@ -4,10 +4,20 @@ import json
 import threading
 import websockets
 
+HEARTBEAT_INTERVAL = 1  # seconds
+RECONNECT_DELAY = 0.5  # seconds, doubled after each failed attempt
+MAX_RECONNECT_DELAY = 30  # seconds
+CLOSE = object()  # queued to close the connection once everything before it is sent
+
 
 # import wingdbstub
 
 class Reporter:
+    """
+    Report to OpenAgua over a single websocket connection, which is kept open (and reopened if lost) by an event loop
+    in its own thread. Events are queued for that thread to send, and heartbeats are sent over the same connection.
+    """
+
     def __init__(self, args):
         self.flavor = 'websocket'
 
@@ -17,45 +27,89 @@ class Reporter:
         self._network_id = int(args.network_id)
         self._paused = False
         self._canceled = False
-        self.heartbeat_timer = None
+        self._heartbeat_on = False
+        self._pending = None  # a message taken from the queue but not yet sent
+
+        self._loop = asyncio.new_event_loop()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run_loop, name='websocket', daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
         self._start(args)
 
-    def send_event(self, event, data={}):
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._messages = asyncio.Queue()
+        self._task = self._loop.create_task(self._connection())
+        self._ready.set()
+        try:
+            self._loop.run_until_complete(self._task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self._loop.close()
+
+    def send_event(self, event, data=None):
+        data = dict(data or {})
         data.update(dict(
             sid=self._id,
             source_id=self._source_id,
             network_id=self._network_id
         ))
-        asyncio.get_event_loop().run_until_complete(self._send_event(event, data))
-
-    async def _send_event(self, event, data=None):
-        async with websockets.connect(self._ws_url) as websocket:
-            await websocket.send(json.dumps({'action': event, 'data': data}))
-
-    async def send_ping(self, sid):
-        async with websockets.connect(self._ws_url) as websocket:
-            await websocket.send(json.dumps({'action': 'ping', 'data': sid}))
-            # the server will send back the current state of the model so we know
-            # if the user paused/resumed/stopped the run from the UI.
-            return await websocket.recv()
-
-    def ping(self, sid):
-        ## since this is in it's own thread, we need to get a new event loop
-        ## TODO this may be bad according to: https://stackoverflow.com/questions/46727787/runtimeerror-there-is-no-current-event-loop-in-thread-in-async-apscheduler
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        done = asyncio.get_event_loop().run_until_complete(self.send_ping(sid))
-        loop.close()
-        return done
-
-    def _init_heartbeat(self):
-        self.heartbeat_timer = threading.Timer(1, self._heartbeat).start()
-
-    def _heartbeat(self):
-
-        ## we send back the client status with the ping status so we know
-        ## if they want to stop/pause the process.
-        state = self.ping(self._id)
+        self._put({'action': event, 'data': data})
+
+    def _put(self, message):
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._messages.put_nowait, message)
+
+    async def _connection(self):
+        delay = RECONNECT_DELAY
+        while True:
+            try:
+                websocket = await websockets.connect(self._ws_url)
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.InvalidHandshake) as err:
+                print('Failed to connect to {} ({}). Retrying in {} seconds.'.format(self._ws_url, err, delay))
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+            delay = RECONNECT_DELAY
+
+            sender = self._loop.create_task(self._send_messages(websocket))
+            others = [self._loop.create_task(self._receive(websocket)), self._loop.create_task(self._ping(websocket))]
+            done, pending = await asyncio.wait([sender] + others, return_when=asyncio.FIRST_COMPLETED)
+            for task in others:
+                task.cancel()
+            for task in done:
+                task.exception()  # if set, the connection was lost; we reconnect below
+            if sender in done and sender.exception() is None:
+                await websocket.close()
+                return  # closed once everything was sent
+            sender.cancel()
+            await websocket.close()
+
+    async def _send_messages(self, websocket):
+        while True:
+            if self._pending is None:
+                self._pending = await self._messages.get()
+            if self._pending is CLOSE:
+                return
+            await websocket.send(json.dumps(self._pending))
+            self._pending = None
+
+    async def _receive(self, websocket):
+        ## the server sends back the current state of the model with each ping, so we know
+        ## if the user paused/resumed/stopped the run from the UI.
+        while True:
+            self._update_state(await websocket.recv())
+
+    async def _ping(self, websocket):
+        while True:
+            if self._heartbeat_on:
+                await websocket.send(json.dumps({'action': 'ping', 'data': self._id}))
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+    def _update_state(self, state):
 
         if state is not None:
             state = state.lower()
@@ -67,11 +121,20 @@ class Reporter:
         if state == 'canceled':
             self._canceled = True
 
-        self._init_heartbeat()
+    def _init_heartbeat(self):
+        self._heartbeat_on = True
 
     def _cancel_heartbeat(self):
-        if self.heartbeat_timer is not None:
-            self.heartbeat_timer.cancel()
+        self._heartbeat_on = False
+
+    def close(self, timeout=30):
+        """Send any queued events, then close the connection"""
+        self._cancel_heartbeat()
+        self._put(CLOSE)
+        self._thread.join(timeout=timeout)
+        if self._thread.is_alive():
+            print('Warning: could not send all events to {} within {} seconds'.format(self._ws_url, timeout))
+            self._loop.call_soon_threadsafe(self._task.cancel)
 
     def _start(self, args):
         self._init_heartbeat()
@@ -92,7 +155,9 @@ class Reporter:
             self.send_event('cancel', data={'extra_info': 'at step: ' + str(current_step) + '/' + str(total_steps)})
         else:
             self.send_event('done')
+        self.close()
 
     def error(self, msg):
         self._cancel_heartbeat()
         self.send_event('error', data={'extra_info': msg})
+        self.close()
@@ -0,0 +1,99 @@
+import threading
+from collections import deque
+
+MAX_QUEUE = 100  # the most messages waiting to be sent
+COALESCED = ['step', 'save']  # progress messages, of which only the latest waiting one is worth sending
+FINAL = ['done', 'error']
+
+
+class QueuedReporter(object):
+    """
+    Send another reporter's messages from a single background thread, so a slow endpoint never holds up a run.
+
+    Payloads are completed (with the updater) when reported, so they describe the run at that moment, and are then
+    queued. A progress message replaces a waiting one of the same kind, and a final message (done or error) replaces
+    any waiting progress messages, so the queue never builds up behind a slow endpoint. Call close (or flush) when a
+    run finishes so the last messages are sent.
+    """
+
+    def __init__(self, reporter, max_queue=MAX_QUEUE):
+        self.reporter = reporter
+        self.updater = reporter.updater
+        reporter.updater = None  # payloads are completed here, when reported
+        self.max_queue = max_queue
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.sending = False
+        self.closed = False
+        self.dropped = 0
+        self.thread = None
+
+    def report(self, action, **payload):
+        if self.updater:
+            payload = self.updater(action=action, **payload)
+        payload['action'] = action
+
+        with self.condition:
+            if self.closed:
+                return
+            if action in COALESCED and self.queue and self.queue[-1][0] == action:
+                self.queue[-1] = (action, payload)
+            else:
+                if action in FINAL:
+                    self._drop(lambda a: a in COALESCED)
+                while len(self.queue) >= self.max_queue and self._drop(lambda a: a in COALESCED, count=1):
+                    pass
+                while len(self.queue) >= self.max_queue:
+                    self.condition.wait()  # only final messages are waiting; these are never dropped
+                self.queue.append((action, payload))
+            self._start()
+            self.condition.notify_all()
+
+    def _drop(self, which, count=None):
+        """Drop (the oldest) waiting messages, returning how many were dropped"""
+        dropped = [item for item in self.queue if which(item[0])][:count]
+        for item in dropped:
+            self.queue.remove(item)
+        self.dropped += len(dropped)
+        return len(dropped)
+
+    def _start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._send_all, name='reporter', daemon=True)
+            self.thread.start()
+
+    def _send_all(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                action, payload = self.queue.popleft()
+                self.sending = True
+                self.condition.notify_all()
+            try:
+                self.reporter.report(**payload)
+            except Exception as err:
+                print('Failed to report progress ({}): {}'.format(action, err))
+            finally:
+                with self.condition:
+                    self.sending = False
+                    self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Wait until all waiting messages are sent, returning False if timed out"""
+        with self.condition:
+            return self.condition.wait_for(lambda: not self.queue and not self.sending, timeout=timeout)
+
+    def close(self, timeout=30):
+        """Send any waiting messages and stop the sender thread"""
+        sent = self.flush(timeout=timeout)
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=timeout)
+            self.thread = None
+        if not sent:
+            print('Warning: progress reporting did not finish within {} seconds'.format(timeout))
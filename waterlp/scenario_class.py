@@ -55,7 +55,7 @@ class Scenario(object):
 
             this_chain = [source.id]
 
-            # TODO: pull this chaining info from list of scenarios rather than hitting Hydra Platform multiple times
+            # parents not loaded with the network are usually prefetched (see connection.prefetch_ancestors)
             while source['layout'].get('parent'):
                 parent_id = source['layout']['parent']
                 if parent_id not in self.source_ids:  # prevent adding in Baseline twice, which would overwrite options
@@ -63,7 +63,7 @@ class Scenario(object):
                 if parent_id in loaded_scenarios:
                     source = loaded_scenarios[parent_id]
                 else:
-                    source = conn.call('get_scenario', {'scenario_id': parent_id})
+                    source = conn.get_scenario(parent_id)
 
                 self.source_scenarios[source.id] = source
 
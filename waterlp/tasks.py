@@ -1,32 +1,36 @@
 import os
+import time
 import getpass
 import json
 from datetime import datetime
-from itertools import product
+from itertools import chain, islice
 from copy import copy
+from functools import partial
 from ast import literal_eval
-from os import environ
 
-from waterlp import app
+from waterlp.celery_app import app
 from celery.exceptions import Ignore
 
-from waterlp.reporters.redis import local_redis
 from waterlp.reporters.post import Reporter as PostReporter
-from waterlp.reporters.ably import AblyReporter
-from waterlp.reporters.pubnub import PubNubReporter
 from waterlp.reporters.screen import ScreenReporter
+from waterlp.reporters.queued import QueuedReporter
 from waterlp.logger import RunLogger
 from waterlp.parser import commandline_parser
 from waterlp.connection import connection
 from waterlp.logger import create_logger
 from waterlp.models.system import WaterSystem
 from waterlp.scenario_class import Scenario
-from waterlp.utils.scenarios import create_subscenarios
-from waterlp.utils.application import ProcessState
+from waterlp.utils.scenarios import create_subscenarios, iter_variation_sets
+from waterlp.utils.application import CancellationToken
+from waterlp.utils.artifacts import publish_artifact, load_artifact
+from waterlp.utils.chunking import make_chunks, record_runtime
+from waterlp.utils.local_pool import run_pool
 
 current_step = 0
 total_steps = 0
 
+_prepared_systems = {}  # by sid, for local pool workers, which get them when they fork
+
 
 class Object(object):
     def __init__(self, values):
@@ -34,11 +38,8 @@ class Object(object):
             setattr(self, key, values[key])
 
 
-run_key = environ.get('RUN_KEY')
-model_key = environ['MODEL_KEY']
-queue_name = 'model-{}'.format(model_key)
-if run_key:
-    queue_name += '-{}'.format(run_key)
+def is_canceled(sid):
+    return CancellationToken(sid).poll()
 
 
 @app.task(name='openagua.run')
@@ -146,6 +147,10 @@ def run_scenarios(args, networklog):
     # this gets all scenarios in the system, not just the main scenarios of interest, but without data
     network = conn.get_basic_network()
 
+    # get the ancestry of all the requested scenarios at once, rather than parent by parent
+    if not args.filename:
+        conn.prefetch_ancestors(all_scenario_ids, network.scenarios)
+
     # create the system
     base_system = WaterSystem(
         conn=conn,
@@ -157,7 +162,7 @@ def run_scenarios(args, networklog):
         args=args,
     )
 
-    all_supersubscenarios = []
+    groups = []  # (supersubscenarios, count, number of time steps) for each prepared system
 
     # prepare the reporter
     post_reporter = PostReporter(args) if args.post_url else None
@@ -172,7 +177,7 @@ def run_scenarios(args, networklog):
         sid = '-'.join([args.unique_id] + [str(s) for s in set(scenario_ids)])
 
         try:
-            if local_redis.get(sid) == ProcessState.CANCELED:
+            if is_canceled(sid):
                 print('Canceled by user')
                 raise Ignore
         except Exception as err:
@@ -200,8 +205,7 @@ def run_scenarios(args, networklog):
             system.initialize_time_steps()
             system.collect_source_data()
 
-            # organize the subscenarios
-            flattened = product(option_subscenarios, scenario_subscenarios)
+            # organize the subscenarios; these are only made as they are dispatched
             subscenario_count = len(option_subscenarios) * len(scenario_subscenarios)
 
             if args.debug:
@@ -215,14 +219,17 @@ def run_scenarios(args, networklog):
             system.scenario.subscenario_count = subscenario_count
             system.scenario.total_steps = subscenario_count * len(system.dates)
 
-            supersubscenarios = [{
-                'i': i + 1,
-                'sid': sid,
-                'system': copy(system),  # this is intended to be a shallow copy
-                'variation_sets': variation_sets,
-            } for i, variation_sets in enumerate(flattened)]
+            # the prepared system is serialized just once, and tasks carry only its key
+            # (local runs share it with worker processes when they fork)
+            local = args.debug or args.local_workers
+            artifact = None if local else publish_artifact(system, store_dir=args.artifact_dir)
+            if args.local_workers:
+                _prepared_systems[sid] = system
 
-            all_supersubscenarios.extend(supersubscenarios[:subscenario_count])
+            variation_sets = iter_variation_sets(option_subscenarios, scenario_subscenarios)
+            supersubscenarios = iter_supersubscenarios(sid, system, islice(variation_sets, subscenario_count),
+                                                       artifact=artifact, with_system=args.debug)
+            groups.append((supersubscenarios, subscenario_count, len(system.dates)))
 
         except Exception as err:
             err_class = err.__class__.__name__
@@ -247,27 +254,63 @@ def run_scenarios(args, networklog):
     # run the scenario
     # ================
 
+    all_supersubscenarios = chain.from_iterable(supersubscenarios for supersubscenarios, count, nsteps in groups)
+
     if args.debug:
-        run_scenario(all_supersubscenarios[0], args=args, verbose=verbose)
+        run_scenario(next(all_supersubscenarios), args=args, verbose=verbose)
+    elif args.local_workers:
+        count = sum(count for supersubscenarios, count, nsteps in groups)
+        total_steps = sum(count * nsteps for supersubscenarios, count, nsteps in groups)
+        run = partial(_run_local, args=args, verbose=verbose)
+        nfailed = run_pool(all_supersubscenarios, run, total_steps, count, workers=args.local_workers)
+        if nfailed:
+            raise Exception('{} of {} subscenarios failed.'.format(nfailed, count))
+    elif args.chunk_target:
+        # several subscenarios per task, with the number chosen from past runtimes
+        for supersubscenarios, count, nsteps in groups:
+            for chunk in make_chunks(supersubscenarios, count, nsteps, args.network_id, args.chunk_target):
+                run_scenario_chunk.apply_async((chunk, args, verbose), serializer='pickle', compression='gzip')
     else:
         for ss in all_supersubscenarios:
             run_scenario.apply_async((ss, args, verbose), serializer='pickle', compression='gzip')
     return
 
 
-@app.task
-def run_scenario(supersubscenario, args, verbose=False):
-    print("RUNNING SCENARIO: {}".format(print(supersubscenario)))
+def iter_supersubscenarios(sid, system, variation_sets, artifact=None, with_system=False):
+    """The supersubscenarios of a prepared system, made one at a time as they are dispatched"""
+    for i, variation_set in enumerate(variation_sets):
+        yield {
+            'i': i + 1,
+            'sid': sid,
+            'system': copy(system) if with_system else None,  # this is intended to be a shallow copy
+            'artifact': artifact,
+            'nsteps': len(system.dates),
+            'variation_sets': variation_set,
+        }
 
-    global current_step, total_steps
-
-    # Check OA to see if the model request is still valid
-    sid = supersubscenario.get('sid')
-    if local_redis.get(sid) == ProcessState.CANCELED:
-        print("Canceled by user.")
-        raise Ignore
 
+def get_system(supersubscenario, args):
     system = supersubscenario.get('system')
+    if system is None:
+        # the prepared system is loaded once per worker process, so each run gets its own copy
+        system = copy_system(load_artifact(supersubscenario['artifact'], store_dir=args.artifact_dir))
+    return system
+
+
+def copy_system(base_system):
+    """
+    A shallow copy of a prepared system for one run. It shares the prepared data, but has its own scenario and
+    evaluator, with its own function results and raw values, so nothing computed in one run leaks into another.
+    """
+    system = copy(base_system)
+    system.scenario = copy(base_system.scenario)
+    system.evaluator = copy(base_system.evaluator)
+    system.evaluator.hashstore = {}
+    system.evaluator.rs_values = copy(base_system.evaluator.rs_values)
+    return system
+
+
+def get_reporter(system, args):
 
     # setup the reporter (ably is on a per-process basis)
     post_reporter = PostReporter(args) if args.post_url else None
@@ -278,21 +321,43 @@ def run_scenario(supersubscenario, args, verbose=False):
         post_reporter.is_main_reporter = True
         reporter = post_reporter
     elif args.message_protocol == 'ably':
+        from waterlp.reporters.ably import AblyReporter
         reporter = AblyReporter(args, post_reporter=post_reporter)
     elif args.message_protocol == 'pubnub':
+        from waterlp.reporters.pubnub import PubNubReporter
         reporter = PubNubReporter(args, publish_key=args.publish_key, post_reporter=post_reporter)
     if reporter:
+        # payloads are completed by the queued reporter, so the reporters behind it don't need the updater
         reporter.updater = system.scenario.update_payload
+        reporter = QueuedReporter(reporter)
         system.scenario.reporter = reporter
 
-    if post_reporter:
-        post_reporter.updater = system.scenario.update_payload
+    return reporter
+
+
+@app.task
+def run_scenario(supersubscenario, args, verbose=False):
+    print("RUNNING SCENARIO: {}".format(print(supersubscenario)))
+
+    global current_step, total_steps
+
+    # Check OA to see if the model request is still valid
+    sid = supersubscenario.get('sid')
+    if is_canceled(sid):
+        print("Canceled by user.")
+        raise Ignore
+
+    system = get_system(supersubscenario, args)
+    reporter = get_reporter(system, args)
 
     try:
 
         # for result in _run_scenario(system, args, conn, supersubscenario, reporter=reporter, verbose=verbose):
         #     pass
+        t0 = time.time()
         _run_scenario(system, args, supersubscenario, reporter=reporter, verbose=verbose)
+        if args.chunk_target:
+            record_runtime(args.network_id, (time.time() - t0) / len(system.dates))
 
     except Ignore as err:
         raise
@@ -304,8 +369,67 @@ def run_scenario(supersubscenario, args, verbose=False):
         if reporter:
             reporter.report(action='error', message=str(err))
 
+    finally:
+        if reporter:
+            reporter.close()
+
+
+def _run_local(index, supersubscenario, reporter_class, args=None, verbose=False):
+    """Run a supersubscenario in a local pool worker (see run_pool)"""
+    system = copy_system(_prepared_systems[supersubscenario['sid']])
+    system.scenario.finished = 0
+    reporter = reporter_class(index, system.scenario)
+    system.scenario.reporter = reporter
+    _run_scenario(system, args, supersubscenario, reporter=reporter, verbose=verbose)
+
+
+@app.task
+def run_scenario_chunk(supersubscenarios, args, verbose=False):
+    """Run several subscenarios of the same prepared system, one after another, reusing the model where possible"""
+
+    system = get_system(supersubscenarios[0], args)
+    reporter = get_reporter(system, args)
+
+    reuse_model = False
+    try:
+        for supersubscenario in supersubscenarios:
+            print("RUNNING SCENARIO: {}".format(supersubscenario.get('i')))
+
+            sid = supersubscenario.get('sid')
+            if is_canceled(sid):
+                print("Canceled by user.")
+                raise Ignore
+
+            # function results and progress are per subscenario
+            system.evaluator.hashstore = {}
+            system.scenario.finished = 0
+
+            t0 = time.time()
+            try:
+                _run_scenario(system, args, supersubscenario, reporter=reporter, verbose=verbose,
+                              reuse_model=reuse_model)
+                if args.chunk_target:
+                    record_runtime(args.network_id, (time.time() - t0) / len(system.dates))
+                reuse_model = True
+
+            except Ignore:
+                raise
 
-def _run_scenario(system=None, args=None, supersubscenario=None, reporter=None, verbose=False):
+            except Exception as err:
+
+                print(err)
+
+                if reporter:
+                    reporter.report(action='error', message=str(err))
+
+                reuse_model = False  # the model may have been left mid-run
+
+    finally:
+        if reporter:
+            reporter.close()
+
+
+def _run_scenario(system=None, args=None, supersubscenario=None, reporter=None, verbose=False, reuse_model=False):
     global current_step, total_steps
 
     debug = args.debug
@@ -316,7 +440,10 @@ def _run_scenario(system=None, args=None, supersubscenario=None, reporter=None,
     # current_dates = system.dates[0:foresight_periods]
 
     # intialize
-    system.initialize(supersubscenario)
+    if reuse_model:
+        system.reinitialize(supersubscenario)
+    else:
+        system.initialize(supersubscenario)
 
     # 1. UPDATE INITIAL CONDITIONS
     # TODO: delete this once the irregular time step routine of Pywr is implemented
@@ -329,93 +456,96 @@ def _run_scenario(system=None, args=None, supersubscenario=None, reporter=None,
     i = 0
     now = datetime.now()
 
-    while i < n:
+    # cancellation is flagged by a background listener, so checking it each time step is cheap
+    with CancellationToken(sid) as cancellation:
 
-        if local_redis.get(sid) == ProcessState.CANCELED:
-            print("Canceled by user.")
-            raise Ignore
+        while i < n:
 
-        ts = runs[i]
-        current_step = i + 1
+            if cancellation.is_set():
+                print("Canceled by user.")
+                raise Ignore
 
-        if verbose:
-            print('current step: %s' % current_step)
+            ts = runs[i]
+            current_step = i + 1
 
-        #######################
-        # CORE SCENARIO ROUTINE
-        #######################
+            if verbose:
+                print('current step: %s' % current_step)
 
-        current_dates = system.dates[ts:ts + system.foresight_periods]
-        current_dates_as_string = system.dates_as_string[ts:ts + system.foresight_periods]
-        step = (system.dates[ts] - system.dates[ts - 1]).days if ts else system.dates[0].day
-        # 1. Update timesteps
-        system.model.update_timesteps(
-            start=current_dates_as_string[0],
-            end=current_dates_as_string[-1],
-            step=step
-        )
+            #######################
+            # CORE SCENARIO ROUTINE
+            #######################
 
-        try:
+            current_dates = system.dates[ts:ts + system.foresight_periods]
+            current_dates_as_string = system.dates_as_string[ts:ts + system.foresight_periods]
+            step = (system.dates[ts] - system.dates[ts - 1]).days if ts else system.dates[0].day
+            # 1. Update timesteps
+            system.model.update_timesteps(
+                start=current_dates_as_string[0],
+                end=current_dates_as_string[-1],
+                step=step
+            )
 
-            # 2. UPDATE BOUNDARY CONDITIONS
+            try:
 
-            system.update_boundary_conditions(ts, ts + system.foresight_periods, step='pre-process')
-            system.update_boundary_conditions(ts, ts + system.foresight_periods, step='main')
+                # 2. UPDATE BOUNDARY CONDITIONS
 
-            # 3. RUN THE MODEL ONE TIME STEP
+                system.update_boundary_conditions(ts, ts + system.foresight_periods, step='pre-process')
+                system.update_boundary_conditions(ts, ts + system.foresight_periods, step='main')
 
-            results = system.step()
+                # 3. RUN THE MODEL ONE TIME STEP
 
-            if i == 0 and args.debug and results:
-                stats = results.to_dataframe()
-                content = stats.to_csv()
-                system.save_to_file('stats.csv', content)
+                results = system.step()
 
-            # 4. COLLECT RESULTS
-            system.collect_results(current_dates_as_string, tsidx=i, suppress_input=args.suppress_input)
+                if i == 0 and args.debug and results:
+                    stats = results.to_dataframe()
+                    content = stats.to_csv()
+                    system.save_to_file('stats.csv', content)
 
-            # 5. CALCULATE POST-PROCESSED RESULTS
-            system.update_boundary_conditions(ts, ts + system.foresight_periods, step='post-process')
+                # 4. COLLECT RESULTS
+                system.collect_results(current_dates_as_string, tsidx=i, suppress_input=args.suppress_input)
 
-            # 6. REPORT PROGRESS
-            system.scenario.finished += 1
-            system.scenario.current_date = current_dates_as_string[0]
+                # 5. CALCULATE POST-PROCESSED RESULTS
+                system.update_boundary_conditions(ts, ts + system.foresight_periods, step='post-process')
 
-            new_now = datetime.now()
-            should_report_progress = ts == 0 or current_step == n or (new_now - now).seconds >= 2
-            # system.dates[ts].month != system.dates[ts - 1].month and (new_now - now).seconds >= 1
+                # 6. REPORT PROGRESS
+                system.scenario.finished += 1
+                system.scenario.current_date = current_dates_as_string[0]
 
-            if system.scenario.reporter and should_report_progress:
-                system.scenario.reporter.report(action='step')
+                new_now = datetime.now()
+                should_report_progress = ts == 0 or current_step == n or (new_now - now).seconds >= 2
+                # system.dates[ts].month != system.dates[ts - 1].month and (new_now - now).seconds >= 1
 
-                now = new_now
+                if system.scenario.reporter and should_report_progress:
+                    system.scenario.reporter.report(action='step')
 
-        except Exception as err:
-            saved = system.save_logs()
-            system.save_results(error=True)
-            msg = 'ERROR: Something went wrong at step {timestep} of {total} ({date}):\n\n{err}'.format(
-                timestep=current_step,
-                total=total_steps,
-                date=current_dates[0].date(),
-                err=err
-            )
-            if saved:
-                msg += '\n\nSee log files in "{}"'.format(args.log_dir)
-            print(msg)
-            if system.scenario.reporter:
-                system.scenario.reporter.report(action='error', message=msg)
+                    now = new_now
+
+            except Exception as err:
+                saved = system.save_logs()
+                system.save_results(error=True)
+                msg = 'ERROR: Something went wrong at step {timestep} of {total} ({date}):\n\n{err}'.format(
+                    timestep=current_step,
+                    total=total_steps,
+                    date=current_dates[0].date(),
+                    err=err
+                )
+                if saved:
+                    msg += '\n\nSee log files in "{}"'.format(args.log_dir)
+                print(msg)
+                if system.scenario.reporter:
+                    system.scenario.reporter.report(action='error', message=msg)
 
-            raise Exception(msg)
+                raise Exception(msg)
 
-        if ts == runs[-1]:
-            system.finish()
-            reporter and reporter.report(action='done')
+            if ts == runs[-1]:
+                system.finish()
+                reporter and reporter.report(action='done')
 
-            print('finished')
+                print('finished')
 
-        i += 1
+            i += 1
 
-        # yield
+            # yield
 
     # POSTPROCESSING HERE (IF ANY)
 
@@ -1,10 +1,15 @@
 import json
+import time
+import threading
+from weakref import WeakSet
 
-from pubnub.callbacks import SubscribeCallback
-from pubnub.enums import PNOperationType, PNStatusCategory
+from redis.exceptions import RedisError
 
 from waterlp.reporters.redis import local_redis
 
+STATE_CHANNEL = 'waterlp:state'  # Redis channel for run state changes, e.g., cancellations
+POLL_INTERVAL = 5  # seconds between fallback checks of a run's state in Redis
+
 class ProcessState:
     REQUESTED = b'requested'
     STARTED = b'started'
@@ -15,6 +20,104 @@ class ProcessState:
     FINISHED = b'finished'
 
 
+def set_state(sid, state):
+    """Record a run's new state, and tell any listening runs about it at once"""
+    if type(state) == str:
+        state = state.encode()
+    local_redis.set(sid, state)
+    local_redis.expire(sid, 3600 * 24)
+    local_redis.publish(STATE_CHANNEL, json.dumps({'sid': sid, 'state': state.decode()}))
+    CancellationToken.notify(sid, state)
+
+
+class CancellationToken(object):
+    """
+    An in-process cancellation flag for a run.
+
+    The flag is set by a background listener on the Redis state channel (or directly, by a state change in this
+    process), so checking it in the time loop is just an attribute check. There is one listener per process, shared
+    by all live tokens, and stopped when the last one is. In case a message is missed, the state in Redis is also
+    checked, at most once every poll_interval seconds.
+    """
+
+    _tokens = WeakSet()  # live tokens in this process
+    _lock = threading.Lock()
+    _pubsub = None  # the shared listener
+    _thread = None
+
+    def __init__(self, sid, poll_interval=POLL_INTERVAL):
+        self.sid = sid
+        self.poll_interval = poll_interval
+        self.canceled = False
+        self.last_poll = 0
+
+    def start(self):
+        cls = type(self)
+        with cls._lock:
+            cls._tokens.add(self)
+            if cls._pubsub is None:
+                try:
+                    pubsub = local_redis.pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(**{STATE_CHANNEL: cls.on_message})
+                    cls._thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+                    cls._pubsub = pubsub
+                except RedisError:
+                    pass  # no listener, so rely on polling
+        return self
+
+    def stop(self):
+        cls = type(self)
+        with cls._lock:
+            cls._tokens.discard(self)
+            if cls._tokens:
+                return
+            if cls._thread is not None:
+                cls._thread.stop()
+                cls._thread = None
+            if cls._pubsub is not None:
+                cls._pubsub.close()
+                cls._pubsub = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    @classmethod
+    def on_message(cls, message):
+        try:
+            data = json.loads(message['data'])
+        except (TypeError, ValueError):
+            return
+        if data.get('sid'):
+            cls.notify(data['sid'], data.get('state', '').encode())
+
+    @classmethod
+    def notify(cls, sid, state):
+        with cls._lock:
+            tokens = list(cls._tokens)
+        for token in tokens:
+            if token.sid == sid and state == ProcessState.CANCELED:
+                token.canceled = True
+
+    def poll(self):
+        self.last_poll = time.time()
+        try:
+            if local_redis.get(self.sid) == ProcessState.CANCELED:
+                self.canceled = True
+        except RedisError:
+            pass  # e.g., a local run with no Redis server
+        return self.canceled
+
+    def is_set(self):
+        if self.canceled:
+            return True
+        if time.time() - self.last_poll >= self.poll_interval:
+            return self.poll()
+        return False
+
+
 def message_handler(message):
     if not message:
         return
@@ -23,66 +126,4 @@ def message_handler(message):
     action = data.get('action')
     sid = data.get('sid')
     if sid and action == 'cancel':
-        local_redis.set(sid, ProcessState.CANCELED)
-        local_redis.expire(sid, 3600 * 24)
-
-
-class PNSubscribeCallback(SubscribeCallback):
-    def status(self, pubnub, status):
-        pass
-        # The status object returned is always related to subscribe but could contain
-        # information about subscribe, heartbeat, or errors
-        # use the operationType to switch on different options
-        if status.operation == PNOperationType.PNSubscribeOperation \
-                or status.operation == PNOperationType.PNUnsubscribeOperation:
-            if status.category == PNStatusCategory.PNConnectedCategory:
-                pass
-                # This is expected for a subscribe, this means there is no error or issue whatsoever
-            elif status.category == PNStatusCategory.PNReconnectedCategory:
-                pass
-                # This usually occurs if subscribe temporarily fails but reconnects. This means
-                # there was an error but there is no longer any issue
-            elif status.category == PNStatusCategory.PNDisconnectedCategory:
-                pass
-                # This is the expected category for an unsubscribe. This means there
-                # was no error in unsubscribing from everything
-            elif status.category == PNStatusCategory.PNUnexpectedDisconnectCategory:
-                pass
-                # This is usually an issue with the internet connection, this is an error, handle
-                # appropriately retry will be called automatically
-            elif status.category == PNStatusCategory.PNAccessDeniedCategory:
-                pass
-                # This means that PAM does allow this client to subscribe to this
-                # channel and channel group configuration. This is another explicit error
-            else:
-                pass
-                # This is usually an issue with the internet connection, this is an error, handle appropriately
-                # retry will be called automatically
-        elif status.operation == PNOperationType.PNSubscribeOperation:
-            # Heartbeat operations can in fact have errors, so it is important to check first for an error.
-            # For more information on how to configure heartbeat notifications through the status
-            # PNObjectEventListener callback, consult <link to the PNCONFIGURATION heartbeart config>
-            if status.is_error():
-                pass
-                # There was an error with the heartbeat operation, handle here
-            else:
-                pass
-                # Heartbeat operation was successful
-        else:
-            pass
-            # Encountered unknown status type
-
-    def presence(self, pubnub, presence):
-        pass  # handle incoming presence data
-
-    def message(self, pubnub, data):
-        message = data.message
-        if message:
-            state = message.get('state')
-            sid = data.message.get('sid')
-            if sid:
-                local_redis.set(sid, state)
-                local_redis.expire(sid, 3600 * 24)
-                print(sid, state)
-
-        return
+        set_state(sid, ProcessState.CANCELED)
@@ -0,0 +1,62 @@
+import os
+import zlib
+import pickle
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+from waterlp.reporters.redis import local_redis
+
+ARTIFACT_PREFIX = 'waterlp:artifact:'
+ARTIFACT_TTL = 24 * 60 * 60  # seconds
+MAX_LOADED = 4  # the number of artifacts kept loaded in each worker process
+
+_loaded = OrderedDict()  # artifact key -> object, most recently used last
+
+
+def publish_artifact(obj, store_dir=None, ttl=ARTIFACT_TTL):
+    """
+    Serialize an object once, as a content-addressed artifact, to a shared local directory if given, or else Redis.
+    Publishing the same content again is a no-op.
+
+    :return: the artifact key
+    """
+
+    data = zlib.compress(pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL), 1)
+    key = ARTIFACT_PREFIX + hashlib.sha256(data).hexdigest()
+
+    if store_dir:
+        path = os.path.join(store_dir, key.replace(':', '-'))
+        if not os.path.exists(path):
+            os.makedirs(store_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=store_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+    else:
+        local_redis.set(key, data, ex=ttl, nx=True)
+
+    return key
+
+
+def load_artifact(key, store_dir=None):
+    """Load an artifact, once per worker process"""
+
+    if key in _loaded:
+        _loaded.move_to_end(key)
+        return _loaded[key]
+
+    if store_dir:
+        with open(os.path.join(store_dir, key.replace(':', '-')), 'rb') as f:
+            data = f.read()
+    else:
+        data = local_redis.get(key)
+        if data is None:
+            raise Exception('Artifact {} was not found. It may have expired.'.format(key))
+
+    obj = pickle.loads(zlib.decompress(data))
+    _loaded[key] = obj
+    while len(_loaded) > MAX_LOADED:
+        _loaded.popitem(last=False)
+
+    return obj
@@ -0,0 +1,85 @@
+import os
+import gzip
+import json
+import hashlib
+import tempfile
+
+# shared by all worker processes on a node (unlike ~/.waterlp, which is cleared when a worker starts)
+CACHE_DIR = os.environ.get('WATERLP_CACHE_DIR', os.path.expanduser('~/.cache/waterlp'))
+MAX_ENTRIES = 20
+
+
+def revision_token(network, scenario_ids=None, template=None):
+    """
+    A token for the current revision of a network, its scenarios and its template, from a basic (data-free) network.
+
+    This is made from the modification dates the server reports, so it's cheap to get. If the network, the template
+    or any of the scenarios has none, there is no way to validate a cached copy (a creation date never changes, so it
+    can't show edits), so None is returned and nothing is cached.
+    """
+
+    scenarios = [s for s in network.get('scenarios', []) if not scenario_ids or s['id'] in scenario_ids]
+    if not network.get('updated_at') or not all(s.get('updated_at') for s in scenarios):
+        return None
+    if not template or not template.get('updated_at'):
+        return None
+    parts = [network['id'], network['updated_at']] + [(s['id'], s['updated_at'])
+                                                        for s in sorted(scenarios, key=lambda s: s['id'])]
+    parts.append((template.get('id'), template['updated_at']))
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+class ResponseCache(object):
+    """
+    A compressed, on-disk cache of large data server responses, validated with a revision token.
+
+    Entries are written to a temporary file and then moved into place, so worker processes sharing the cache never
+    read a partly written entry.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_entries=MAX_ENTRIES, object_hook=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.object_hook = object_hook
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        name = hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+        return os.path.join(self.directory, name + '.json.gz')
+
+    def get(self, key, token):
+        path = self._path(key)
+        try:
+            with gzip.open(path, 'rt') as f:
+                entry = json.load(f, object_hook=self.object_hook)
+        except (IOError, ValueError):
+            return None
+        if entry.get('token') != token:
+            return None
+        os.utime(path)  # mark it as recently used
+        return entry['value']
+
+    def put(self, key, token, value):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            with gzip.open(tmp_path, 'wt') as f:
+                json.dump({'token': token, 'value': value}, f)
+            os.replace(tmp_path, self._path(key))
+        except:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.prune()
+
+    def prune(self):
+        """Remove the least recently used entries beyond max_entries"""
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith('.json.gz')]
+        if len(paths) <= self.max_entries:
+            return
+        paths.sort(key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0)
+        for path in paths[:-self.max_entries]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass  # another process got to it first
@@ -0,0 +1,57 @@
+from math import ceil
+
+from redis.exceptions import RedisError
+
+from waterlp.reporters.redis import local_redis
+
+RUNTIME_KEY = 'waterlp:runtime:{}'  # smoothed seconds per time step, by network
+RUNTIME_SMOOTHING = 0.3  # the weight of the latest measurement
+MAX_CHUNK_SIZE = 100
+
+
+def record_runtime(network_id, seconds_per_step, smoothing=RUNTIME_SMOOTHING):
+    """
+    Update the smoothed (exponential moving average) runtime per time step of a network. This only informs chunk
+    sizes, so a Redis failure is reported rather than raised, and never fails the run that was measured.
+    """
+    key = RUNTIME_KEY.format(network_id)
+    try:
+        previous = local_redis.get(key)
+        if previous is not None:
+            seconds_per_step = smoothing * seconds_per_step + (1 - smoothing) * float(previous)
+        local_redis.set(key, seconds_per_step)
+    except RedisError as err:
+        print('Failed to record the runtime of network {}: {}'.format(network_id, err))
+
+
+def get_chunk_size(network_id, nsteps, target, max_size=MAX_CHUNK_SIZE):
+    """
+    The number of subscenarios to run per task, so each task takes about target seconds.
+    With no runtime measured yet for the network, each subscenario is its own task.
+    """
+    seconds_per_step = local_redis.get(RUNTIME_KEY.format(network_id))
+    if seconds_per_step is None or not nsteps:
+        return 1
+    runtime = float(seconds_per_step) * nsteps
+    if runtime <= 0:
+        return max_size
+    return max(1, min(max_size, int(target // runtime)))
+
+
+def make_chunks(supersubscenarios, count, nsteps, network_id, target, max_size=MAX_CHUNK_SIZE):
+    """
+    Group supersubscenarios prepared from the same system into chunks of adaptive size, as they are made.
+    The count is used to spread them evenly across the chunks.
+    """
+    size = get_chunk_size(network_id, nsteps, target, max_size=max_size)
+    if count:
+        size = ceil(count / ceil(count / size))
+
+    chunk = []
+    for ss in supersubscenarios:
+        chunk.append(ss)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -1663,22 +1663,46 @@ units = [
 ]
 
 
-def convert(value, dimension, unit1, unit2):
-    dim_units = [dim for dim in units if dim['name'] == dimension]
+# Only temperature scales have a true offset ("cf") from the base unit.
+OFFSET_DIMENSIONS = ['Temperature']
+
 
-    converted = None
+def build_registry(units):
+    """
+    Precompute conversions between every pair of units in each dimension.
 
-    if dim_units:
-        du = dim_units[0]['unit']
-        u1 = list(filter(lambda x: x['abbr'] == unit1, du))
-        u2 = list(filter(lambda x: x['abbr'] == unit2, du))
+    :return: a lookup of (dimension, unit1, unit2) to (factor, offset), such that a value in unit1 is
+    value * factor + offset in unit2
+    """
+    registry = {}
+    for dim in units:
+        dimension = dim['name']
+        scales = {}
+        for u in dim['unit']:
+            if u['abbr'] not in scales:  # the first definition of a unit wins
+                cf = float(u.get('cf', 0)) if dimension in OFFSET_DIMENSIONS else 0.0
+                scales[u['abbr']] = (float(u['lf']), cf)
+        for abbr1, (lf1, cf1) in scales.items():
+            for abbr2, (lf2, cf2) in scales.items():
+                if lf2:
+                    registry[(dimension, abbr1, abbr2)] = (lf1 / lf2, (cf1 - cf2) / lf2)
+    return registry
 
-        if u1 and u2:
-            lf1 = float(u1[0]['lf'])
-            lf2 = float(u2[0]['lf'])
-            converted = value * lf1 / lf2
 
-    return converted
+conversions = build_registry(units)
 
 
+def conversion_factor(dimension, unit1, unit2):
+    """Get the (factor, offset) converting unit1 to unit2, or None if either unit is unknown"""
+    return conversions.get((dimension, unit1, unit2))
 
+
+def convert(value, dimension, unit1, unit2):
+    """Convert a value, or a numpy array of values, from unit1 to unit2. Returns None for unknown units."""
+    conversion = conversions.get((dimension, unit1, unit2))
+    if conversion is None:
+        return None
+    factor, offset = conversion
+    if offset:
+        return value * factor + offset
+    return value * factor
@@ -0,0 +1,108 @@
+import os
+import queue
+import multiprocessing
+
+MAX_WAITING = 2  # subscenarios sent ahead to each worker, so the rest are only made as workers free up
+
+# set in the parent just before the pool forks, so workers share them copy-on-write rather than receiving pickles
+_run = None
+_progress = None
+
+
+class QueueReporter(object):
+    """Report a local worker's progress to the parent process"""
+
+    def __init__(self, index, scenario):
+        self.index = index
+        self.scenario = scenario
+        self.updater = None
+
+    def report(self, action, **payload):
+        _progress.put((self.index, action, self.scenario.finished, payload.get('message')))
+
+
+def _work(index, supersubscenario):
+    try:
+        _run(index, supersubscenario, QueueReporter)
+        return index, None
+    except Exception as err:
+        return index, str(err)
+
+
+class Progress(object):
+    """Progress aggregated across all subscenarios run in the pool"""
+
+    def __init__(self, total_steps, count):
+        self.total_steps = total_steps
+        self.finished = {}
+        self.done = 0
+        self.errors = 0
+        self.count = count
+        self.last = -1
+
+    def update(self, index, action, finished, message=None):
+        self.finished[index] = finished
+        if action == 'done':
+            self.done += 1
+        elif action == 'error':
+            self.errors += 1
+        progress = round(sum(self.finished.values()) / self.total_steps * 100) if self.total_steps else 100
+        if progress != self.last or action in ['done', 'error']:
+            print('progress: {}% ({} of {} subscenarios done, {} failed)'.format(
+                progress, self.done, self.count, self.errors))
+            self.last = progress
+
+
+def run_pool(supersubscenarios, run, total_steps, count, workers=None):
+    """
+    Run supersubscenarios across a local pool of forked processes, with no broker needed.
+
+    Supersubscenarios are taken from the iterable only as workers free up, so a generator of them is never held in
+    memory all at once. They are sent to workers as pickles, so they shouldn't carry a prepared system; anything
+    set up before this is called is shared with the workers when they fork.
+
+    :param supersubscenarios: an iterable of supersubscenarios
+    :param run: a module-level function, called in a worker as run(index, supersubscenario, reporter_class)
+    :param total_steps: the total number of time steps across all supersubscenarios, for progress
+    :param count: the number of supersubscenarios, for progress
+    :param workers: the maximum number of worker processes (defaults to the number of CPUs)
+    :return: the number of supersubscenarios that failed
+    """
+
+    global _run, _progress
+
+    workers = max(1, min(workers or os.cpu_count() or 1, count or 1))
+    context = multiprocessing.get_context('fork')  # the prepared systems are shared copy-on-write
+
+    _run = run
+    _progress = context.Queue()
+    progress = Progress(total_steps, count)
+    failed = []
+    waiting = []  # results of subscenarios sent to the pool
+
+    def collect(timeout):
+        for result in [result for result in waiting if result.ready()]:
+            waiting.remove(result)
+            index, err = result.get()
+            if err:
+                failed.append((index, err))
+        try:
+            progress.update(*_progress.get(timeout=timeout))
+        except queue.Empty:
+            pass
+
+    try:
+        with context.Pool(workers) as pool:
+            for index, supersubscenario in enumerate(supersubscenarios):
+                while len(waiting) >= workers * MAX_WAITING:
+                    collect(0.1)
+                waiting.append(pool.apply_async(_work, (index, supersubscenario)))
+            while waiting or not _progress.empty():
+                collect(0.5)
+    finally:
+        _run = _progress = None
+
+    for index, err in sorted(failed):
+        print('Subscenario {} failed: {}'.format(index + 1, err))
+
+    return len(failed)
@@ -0,0 +1,146 @@
+import json
+from bisect import bisect_left, bisect_right
+
+import numpy
+import pandas as pd
+
+RESULTS_FILE = 'results.h5'
+
+# appended to an end date so it includes every stored date it is a prefix of (e.g., all times on a day)
+END_OF_PREFIX = '~'
+
+# compression for result datasets; zlib is always available with PyTables
+FILTERS = dict(complevel=5, complib='zlib', shuffle=True)
+
+
+def attr_node_name(attr_id):
+    return 'a{}'.format(attr_id)
+
+
+def values_to_array(values, dates_as_string):
+    """Align stored values ({date: value}, or {block: {date: value}}) to the dates, as an array (NaN if missing)"""
+    if values and type(next(iter(values.values()))) == dict:
+        values = next(iter(values.values()))  # the first block
+    return numpy.array([values.get(d, numpy.nan) for d in dates_as_string], dtype=float)
+
+
+def write_results(path, dates_as_string, groups, metadata=None, on_progress=None):
+    """
+    Write results to a single columnar HDF5 file.
+
+    Each resource type/attribute pair is one compressed 2-d dataset, with a row per resource and a column per date,
+    so parts of it can be read back without reading the whole file.
+
+    :param path: the file path
+    :param dates_as_string: the result dates
+    :param groups: a lookup of (resource_type, attr_id) -> dict of attr_name, unit, dimension and rows, where rows is
+        a list of (resource_id, resource_name, values), and values is an array or a function returning one
+    :param metadata: run metadata, stored as JSON with the file
+    :param on_progress: called with the number of groups written so far
+    """
+
+    import tables  # PyTables is only needed where result files are written or read
+
+    with tables.open_file(path, mode='w', title='waterlp results') as h5:
+        h5.root._v_attrs.metadata = json.dumps(metadata or {}, sort_keys=True)
+        h5.create_array('/', 'dates', numpy.array(dates_as_string, dtype=bytes))
+
+        ndates = len(dates_as_string)
+        for i, ((resource_type, attr_id), group) in enumerate(groups.items()):
+            rows = group['rows']
+            if not rows:
+                continue
+            if '/' + resource_type not in h5:
+                h5.create_group('/', resource_type)
+            node = h5.create_group('/' + resource_type, attr_node_name(attr_id), title=group['attr_name'])
+            node._v_attrs.attr_id = attr_id
+            node._v_attrs.attr_name = group['attr_name']
+            node._v_attrs.unit = group.get('unit') or ''
+            node._v_attrs.dimension = group.get('dimension') or ''
+
+            resource_ids, resource_names, values = zip(*rows)
+            h5.create_array(node, 'resource_ids', numpy.array(resource_ids, dtype=int))
+            h5.create_array(node, 'resource_names', numpy.array([n.encode() for n in resource_names]))
+            data = h5.create_carray(node, 'values', atom=tables.Float64Atom(dflt=numpy.nan),
+                                    shape=(len(rows), ndates), filters=tables.Filters(**FILTERS),
+                                    chunkshape=(1, max(1, ndates)))
+            for j, row_values in enumerate(values):
+                data[j] = row_values() if callable(row_values) else row_values
+
+            if on_progress:
+                on_progress(i + 1)
+
+
+class LocalResults(object):
+    """
+    Read results written by write_results, e.g.:
+
+        with LocalResults('./results/.../V00001/results.h5') as results:
+            df = results.read('node', 'Storage', resources=['Reservoir A'], start='2000-01-01', end='2000-12-31')
+    """
+
+    def __init__(self, path):
+        import tables
+
+        self.h5 = tables.open_file(path, mode='r')
+        self.metadata = json.loads(self.h5.root._v_attrs.metadata)
+        self.dates = [d.decode() for d in self.h5.root.dates.read()]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.h5.close()
+
+    def attributes(self):
+        """The available results, as (resource_type, attr_name) pairs"""
+        return [(node._v_parent._v_name, node._v_attrs.attr_name) for node in self._attr_nodes()]
+
+    def _attr_nodes(self):
+        for type_node in self.h5.root._f_iter_nodes(classname='Group'):
+            for node in type_node._f_iter_nodes(classname='Group'):
+                yield node
+
+    def _get_node(self, resource_type, attr):
+        if type(attr) == int:
+            where = '/{}/{}'.format(resource_type, attr_node_name(attr))
+            if where in self.h5:
+                return self.h5.get_node(where)
+        elif '/' + resource_type in self.h5:
+            for node in self.h5.get_node('/' + resource_type)._f_iter_nodes(classname='Group'):
+                if node._v_attrs.attr_name == attr:
+                    return node
+        raise Exception('No results for {} {}'.format(resource_type, attr))
+
+    def read(self, resource_type, attr, resources=None, start=None, end=None):
+        """
+        Read results for one attribute as a DataFrame, with dates as the index and resource names as columns.
+
+        :param resource_type: 'node', 'link' or 'network'
+        :param attr: the attribute name or ID
+        :param resources: resource IDs and/or names to read (defaults to all)
+        :param start: the first date to read (inclusive, as a date string)
+        :param end: the last date to read (inclusive, as a date string; a date alone includes that whole day)
+        """
+
+        node = self._get_node(resource_type, attr)
+        resource_ids = node.resource_ids.read().tolist()
+        resource_names = [n.decode() for n in node.resource_names.read()]
+
+        i0 = bisect_left(self.dates, start) if start else 0
+        i1 = bisect_right(self.dates, end + END_OF_PREFIX) if end else len(self.dates)
+
+        if resources is None:
+            rows = list(range(len(resource_ids)))
+            values = node.values[:, i0:i1]
+        else:
+            rows = [i for i, (rid, name) in enumerate(zip(resource_ids, resource_names))
+                    if rid in resources or name in resources]
+            values = numpy.empty((len(rows), max(0, i1 - i0)))
+            for j, row in enumerate(rows):
+                values[j] = node.values[row, i0:i1]  # each resource is stored as a chunk
+
+        return pd.DataFrame(values.T, index=self.dates[i0:i1], columns=[resource_names[i] for i in rows])
@@ -0,0 +1,61 @@
+import os
+from collections import OrderedDict
+
+# the memory that built models may take up in each worker process
+MAX_MB = float(os.environ.get('WATERLP_MODEL_CACHE_MB', 1024))
+
+
+def current_memory_mb():
+    """The current resident memory of this process, in MB (None if unknown)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+class ModelCache(object):
+    """
+    Built models kept in a worker process between tasks, so later runs of the same network can skip building one.
+
+    Each entry's size is the growth in resident memory while its model was built. The least recently used entries
+    are evicted once the total is over max_mb.
+    """
+
+    def __init__(self, max_mb=MAX_MB):
+        self.max_mb = max_mb
+        self.entries = OrderedDict()  # key -> (model, size in MB), most recently used last
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key is None or key not in self.entries:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key][0]
+
+    def put(self, key, model, size_mb=None):
+        if key is None or self.max_mb <= 0:
+            return
+        self.entries[key] = (model, max(size_mb or 0, 0))
+        self.entries.move_to_end(key)
+        while len(self.entries) > 1 and self.size_mb() > self.max_mb:
+            self.entries.popitem(last=False)
+
+    def size_mb(self):
+        return sum(size for model, size in self.entries.values())
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'entries': len(self.entries),
+            'size_mb': round(self.size_mb(), 1),
+        }
+
+
+models = ModelCache()  # one per worker process
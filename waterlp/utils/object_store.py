@@ -0,0 +1,122 @@
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+MB = 1024 * 1024
+PART_SIZE = 8 * MB  # S3 parts must be at least 5 MB, except the last one
+
+
+class S3Backend(object):
+    """Multipart uploads to an S3 bucket"""
+
+    def __init__(self, bucket):
+        if not bucket:
+            raise Exception('No S3 bucket is specified for the aws_s3 destination.')
+        import boto3
+
+        self.bucket = bucket
+        self.s3 = boto3.client('s3')
+
+    def put(self, key, body):
+        self.s3.put_object(Body=body, Bucket=self.bucket, Key=key)
+
+    def start(self, key):
+        return self.s3.create_multipart_upload(Bucket=self.bucket, Key=key)['UploadId']
+
+    def upload_part(self, key, upload_id, part_number, body):
+        resp = self.s3.upload_part(Body=body, Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                   PartNumber=part_number)
+        return resp['ETag']
+
+    def complete(self, key, upload_id, etags):
+        parts = [{'ETag': etag, 'PartNumber': i + 1} for i, etag in enumerate(etags)]
+        self.s3.complete_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id,
+                                          MultipartUpload={'Parts': parts})
+
+    def abort(self, key, upload_id):
+        self.s3.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+
+
+class LocalBackend(object):
+    """A local directory standing in for an S3 bucket, with the same multipart upload steps"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        path = os.path.join(self.root, key)
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, exist_ok=True)
+        return path
+
+    def put(self, key, body):
+        with open(self._path(key), 'wb') as f:
+            f.write(body)
+
+    def start(self, key):
+        upload_id = self._path(key) + '.parts'
+        os.makedirs(upload_id, exist_ok=True)
+        return upload_id
+
+    def upload_part(self, key, upload_id, part_number, body):
+        part_path = os.path.join(upload_id, '{:05}'.format(part_number))
+        with open(part_path, 'wb') as f:
+            f.write(body)
+        return part_path
+
+    def complete(self, key, upload_id, etags):
+        with open(self._path(key), 'wb') as f:
+            for part_path in etags:
+                with open(part_path, 'rb') as part:
+                    shutil.copyfileobj(part, f)
+        shutil.rmtree(upload_id)
+
+    def abort(self, key, upload_id):
+        shutil.rmtree(upload_id, ignore_errors=True)
+
+
+def get_backend(args):
+    """The object store for the aws_s3 destination: a local directory if one is given (--store_dir), else S3"""
+    store_dir = getattr(args, 'store_dir', None)
+    if store_dir:
+        return LocalBackend(store_dir)
+    return S3Backend(getattr(args, 'aws_s3_bucket', None))
+
+
+def upload_file(backend, key, path, part_size=PART_SIZE, max_workers=4):
+    """
+    Upload a file to the object store, in parts sent in parallel if it is larger than one part.
+
+    At most max_workers parts are held in memory at once.
+
+    :return: the number of parts uploaded
+    """
+
+    size = os.path.getsize(path)
+    if size <= part_size:
+        with open(path, 'rb') as f:
+            backend.put(key, f.read())
+        return 1
+
+    upload_id = backend.start(key)
+    etags = []
+    try:
+        with open(path, 'rb') as f, ThreadPoolExecutor(max_workers=max_workers) as executor:
+            pending = []
+            part_number = 0
+            while True:
+                body = f.read(part_size)
+                if not body:
+                    break
+                part_number += 1
+                pending.append(executor.submit(backend.upload_part, key, upload_id, part_number, body))
+                if len(pending) >= max_workers:
+                    etags.append(pending.pop(0).result())
+            etags.extend([future.result() for future in pending])
+        backend.complete(key, upload_id, etags)
+    except:
+        backend.abort(key, upload_id)
+        raise
+
+    return len(etags)
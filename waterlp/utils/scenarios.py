@@ -80,7 +80,7 @@ def create_independent_subscenarios(network, template, scenario, scenario_type):
 
         attr_id = variation.get('attr_id')
         resources = get_resources(network, template, scenario, variation)
-        values = make_levels(variation)
+        values = unique_levels(make_levels(variation))
 
         for resource in resources:
             ref_key = get_ref_key(resource)
@@ -100,50 +100,78 @@ def create_independent_subscenarios(network, template, scenario, scenario_type):
     return subscenarios
 
 
-def create_crosswise_subscenarios(network, template, scenario, scenario_type):
-    subscenarios = []
+def unique_levels(levels):
+    """Levels without repeats, in their original order"""
+    seen = set()
+    unique = []
+    for level in levels:
+        key = repr(level)  # levels may be unhashable (e.g., lists)
+        if key not in seen:
+            seen.add(key)
+            unique.append(level)
+    return unique
 
-    variations = scenario.layout.get('variations', [])
 
-    values_lookup = {}
-    resources_lookup = {}
-    for variation in variations:
-        values_lookup[variation['id']] = make_levels(variation)
-        resources_lookup[variation['id']] = get_resources(network, template, scenario, variation)
+class CrosswiseSubscenarios(object):
+    """
+    Every combination of the levels of a scenario's crosswise variations, generated as needed rather than all at once.
 
-    def update_variations(obj=None):
-        obj = obj or {}
+    Each variation is an axis, setting the same level for all of its resources. Levels are unique within an axis,
+    and where variations vary the same resource attribute the last one applies, so each combination is different.
+    The number of combinations is known without generating them.
+    """
 
-        for i, variation in enumerate(variations):
+    def __init__(self, network, template, scenario):
+        self.parent_id = scenario.id
+        self.axes = []  # (resource attribute keys, levels, operator)
 
-            resources = resources_lookup[variation['id']]
+        claimed = set()
+        for variation in reversed(scenario.layout.get('variations', [])):
             attr_id = variation.get('attr_id')
-            values = values_lookup[variation['id']]
-
-            for resource in resources:
-                ref_key = get_ref_key(resource)
-                for value in values:
-
+            keys = [(get_ref_key(resource), resource.id, attr_id)
+                    for resource in get_resources(network, template, scenario, variation)]
+            keys = [key for key in keys if key not in claimed]
+            if not keys:
+                continue  # this variation varies nothing that a later one doesn't
+            claimed.update(keys)
+            self.axes.insert(0, (keys, unique_levels(make_levels(variation)), variation.get('operator')))
+
+    def __len__(self):
+        count = 1 if self.axes else 0
+        for keys, levels, operator in self.axes:
+            count *= len(levels)
+        return count
+
+    def __iter__(self):
+        if not self.axes:
+            return
+        for combination in product(*[levels for keys, levels, operator in self.axes]):
+            variations = {}
+            for (keys, levels, operator), value in zip(self.axes, combination):
+                for key in keys:
                     # this creates a unique resource attribute value
-                    obj[(ref_key, resource.id, attr_id)] = {
+                    variations[key] = {
                         'value': value,
-                        'operator': variation.get('operator')
+                        'operator': operator
                     }
+            yield {
+                'parent_id': self.parent_id,
+                'variations': variations
+            }
 
-                    # append to the variations set if on the last variation
-                    if i == len(variations) - 1:
-                        subscenarios.append({
-                            'parent_id': scenario.id,
-                            'variations': obj.copy()
-                        })
 
-                    # else continue on to the next variation set
-                    else:
-                        update_variations(obj)
+def create_crosswise_subscenarios(network, template, scenario, scenario_type):
+    return CrosswiseSubscenarios(network, template, scenario)
 
-    update_variations()
 
-    return subscenarios
+def iter_variation_sets(option_subscenarios, scenario_subscenarios):
+    """
+    Each pair of option and scenario subscenarios. Unlike itertools.product, this doesn't make a copy of each (so
+    crosswise subscenarios are regenerated for each option subscenario instead of being held in memory).
+    """
+    for option_subscenario in option_subscenarios:
+        for scenario_subscenario in scenario_subscenarios:
+            yield option_subscenario, scenario_subscenario
 
 
 def create_concurrent_subscenarios(network, template, scenario, scenario_type):
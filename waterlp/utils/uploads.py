@@ -0,0 +1,107 @@
+import json
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _json_value(v):
+    return None if v is None or v != v else v
+
+
+def serialize_series(value, has_blocks=False):
+    """
+    Serialize a stored result ({date: value}, or {block: {date: value}} with blocks) as a Hydra timeseries.
+    This gives the same JSON as pandas.DataFrame(...).to_json(), without building a DataFrame.
+    """
+    if has_blocks and value and type(next(iter(value.values()))) == dict:
+        blocks = value
+    else:
+        blocks = {0: value}
+    data = {str(b): {d: _json_value(v) for d, v in vals.items()} for b, vals in blocks.items()}
+    return json.dumps(data, separators=(',', ':'))
+
+
+def serialize_array(dates_as_string, values):
+    """Serialize an array of values aligned to dates_as_string as a single-block Hydra timeseries."""
+    data = {'0': dict(zip(dates_as_string, [_json_value(v) for v in values.tolist()]))}
+    return json.dumps(data, separators=(',', ':'))
+
+
+class ResultUploader(object):
+    """
+    Upload resource scenarios to a result scenario in chunks, keeping several chunk uploads in flight at once.
+
+    Chunks are limited both by size (MB) and number of items. Request bodies are gzipped by the connection if the
+    server accepts it.
+    """
+
+    def __init__(self, conn, scenario, max_workers=4, max_mb=10, max_items=100, on_progress=None, debug=False):
+        self.conn = conn
+        self.scenario = scenario
+        self.max_workers = max_workers
+        self.max_mb = max_mb
+        self.max_items = max_items
+        self.on_progress = on_progress
+        self.debug = debug
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = deque()
+        self.chunk = []
+        self.mb = 0
+        self.nchunks = 0
+        self.items_sent = 0
+        self.mb_sent = 0
+        self.start_time = time.time()
+
+    def add(self, rs, mb):
+        if self.chunk and (self.mb + mb > self.max_mb or len(self.chunk) >= self.max_items):
+            self.flush()
+        self.chunk.append(rs)
+        self.mb += mb
+
+    def flush(self):
+        scenario = dict(self.scenario)
+        scenario['resourcescenarios'] = self.chunk
+        future = self.executor.submit(self.conn.dump_results, scenario, compress=True)
+        self.pending.append((future, len(self.chunk), self.mb))
+        self.nchunks += 1
+        self.chunk = []
+        self.mb = 0
+
+        # bound the number of chunks held in memory
+        while len(self.pending) > self.max_workers:
+            self._wait()
+
+    def _wait(self):
+        future, nitems, mb = self.pending.popleft()
+        resp = future.result()
+        if 'id' not in resp:
+            raise Exception('Error saving data')
+        self.items_sent += nitems
+        self.mb_sent += mb
+        if self.on_progress:
+            self.on_progress(self.items_sent)
+
+    def close(self):
+        """Upload what remains, wait for all uploads to finish, and return the throughput in MB/s"""
+        try:
+            if self.chunk or not self.nchunks:
+                self.flush()
+            while self.pending:
+                self._wait()
+        finally:
+            self.executor.shutdown(wait=True)
+
+        elapsed = time.time() - self.start_time
+        throughput = self.mb_sent / elapsed if elapsed else 0
+        if self.debug:
+            print('Uploaded {} results ({:.1f} MB) in {} chunks in {:.1f} s ({:.2f} MB/s)'.format(
+                self.items_sent, self.mb_sent, self.nchunks, elapsed, throughput))
+        return throughput
+
+    def abort(self):
+        """Stop after an error: cancel the uploads not yet started, and wait for the rest to finish"""
+        for future, nitems, mb in self.pending:
+            future.cancel()
+        self.pending.clear()
+        self.executor.shutdown(wait=True)